@@ -1,50 +1,31 @@
+import argparse
+
 import matplotlib.pyplot as plt
 import polars as pl
 from datetime import datetime
 
+from aweme_ids import format_section
+from corpus import CORPUS_PATH, VideoCorpus
+from id_stats import HistogramCache, dataset_files, histogram_frame
+
 def main():
-    video_df = pl.read_parquet('./data/douyin_related_videos.parquet.zstd', columns=['aweme_id'])
-    video_df = video_df.with_columns([
-        pl.col('aweme_id').cast(pl.UInt64).map_elements(lambda i: format(i, '064b'), pl.String).alias('aweme_id_bits')
-    ]).with_columns([
-        pl.from_epoch(pl.col('aweme_id_bits').str.slice(0, 32).map_elements(lambda x: int(x, 2), pl.Int64)).alias('timestamp'),
-        pl.col('aweme_id_bits').str.slice(32, 10).map_elements(lambda x: int(x, 2), pl.Int64).alias('millisecond'),
-        pl.col('aweme_id_bits').str.slice(42, 22).alias('section_bits')
-    ])
-    
-    # Extract temporal components from timestamps
-    temporal_df = video_df.with_columns([
-        pl.col('timestamp').dt.hour().alias('hour_of_day'),
-        pl.col('timestamp').dt.minute().alias('minute_of_hour'),
-        pl.col('timestamp').dt.second().alias('second_of_minute')
-    ])
-    
-    # Hour distribution (0-23)
-    hourly_data = temporal_df.group_by('hour_of_day').agg(pl.count().alias('count'))
-    complete_hours = pl.DataFrame({
-        'hour_of_day': list(range(24)),
-        'count': [0] * 24
-    }).join(hourly_data, on='hour_of_day', how='left', suffix='_actual').with_columns([
-        pl.coalesce([pl.col('count_actual'), pl.col('count')]).alias('count')
-    ]).select(['hour_of_day', 'count']).sort('hour_of_day')
-    
-    # Minute distribution (0-59)
-    minute_data = temporal_df.group_by('minute_of_hour').agg(pl.count().alias('count'))
-    complete_minutes = pl.DataFrame({
-        'minute_of_hour': list(range(60)),
-        'count': [0] * 60
-    }).join(minute_data, on='minute_of_hour', how='left', suffix='_actual').with_columns([
-        pl.coalesce([pl.col('count_actual'), pl.col('count')]).alias('count')
-    ]).select(['minute_of_hour', 'count']).sort('minute_of_hour')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='*',
+                        help="parquet files or part store directories holding aweme_ids, defaults to the corpus")
+    parser.add_argument('--cache', default='./data/id_stats_cache', help="per-file histogram cache")
+    args = parser.parse_args()
+    if not args.paths:
+        # opening the corpus imports the single-file corpus of older trees into its store
+        VideoCorpus()
+        args.paths = [CORPUS_PATH]
+
+    # One pass per file not seen before, everything else comes from the cache
+    histograms = HistogramCache(args.cache).histograms(dataset_files(args.paths))
     
-    # Second distribution (0-59)
-    second_data = temporal_df.group_by('second_of_minute').agg(pl.count().alias('count'))
-    complete_seconds = pl.DataFrame({
-        'second_of_minute': list(range(60)),
-        'count': [0] * 60
-    }).join(second_data, on='second_of_minute', how='left', suffix='_actual').with_columns([
-        pl.coalesce([pl.col('count_actual'), pl.col('count')]).alias('count')
-    ]).select(['second_of_minute', 'count']).sort('second_of_minute')
+    complete_hours = histogram_frame(histograms['hour'], 'hour_of_day')
+    complete_minutes = histogram_frame(histograms['minute'], 'minute_of_hour')
+    complete_seconds = histogram_frame(histograms['second'], 'second_of_minute')
+    complete_milliseconds = histogram_frame(histograms['millisecond'], 'millisecond')
     
     # Create subplots for temporal and bit distributions
     fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(15, 12))
@@ -74,16 +55,6 @@ def main():
     ax3.grid(axis='y', alpha=0.3)
     
     # Plot bits 32 to 42 distribution (fixed)
-    bits_32_42 = video_df.group_by('millisecond').agg(pl.count().alias('count'))
-    
-    # Create complete range for 10 bits (0-1023) and fill missing values with 0
-    complete_milliseconds = pl.DataFrame({
-        'millisecond': list(range(1024)),
-        'count': [0] * 1024
-    }).join(bits_32_42, on='millisecond', how='left', suffix='_actual').with_columns([
-        pl.coalesce([pl.col('count_actual'), pl.col('count')]).alias('count')
-    ]).select(['millisecond', 'count']).sort('millisecond')
-    
     ax4.plot(complete_milliseconds['millisecond'], complete_milliseconds['count'], 
              marker='o', linestyle='-', color='purple', markersize=1)
     ax4.set_title("Distribution of Bits 32-42 (Millisecond Values)")
@@ -102,7 +73,7 @@ def main():
     print(f"Peak posting second: {complete_seconds.filter(pl.col('count') == pl.col('count').max())['second_of_minute'][0]} seconds past the minute")
     
     # Show some interesting statistics
-    total_videos = len(video_df)
+    total_videos = int(histograms['hour'].sum())
     print(f"\nTotal videos analyzed: {total_videos:,}")
     
     # Find quiet vs busy periods
@@ -123,12 +94,15 @@ def main():
         print("Relatively uniform second-level posting - appears more natural")
     
     # Count unique values in bits 42 to 64 (fixed)
-    unique_counts = video_df.group_by('section_bits').agg(pl.count().alias('count')).sort('count', descending=True)
+    unique_counts = histogram_frame(histograms['section'], 'section')\
+        .filter(pl.col('count') > 0)\
+        .sort('count', descending=True)\
+        .with_columns(pl.col('section').map_elements(format_section, pl.String).alias('section_bits'))
     
     print("Unique counts for bits 42 to 64:")
     print(unique_counts.head(10))  # Show top 10 most frequent
     print(f"\nTotal unique section_bits: {len(unique_counts)}")
-    print(f"Total videos: {len(video_df)}")
+    print(f"Total videos: {total_videos}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,81 @@
+import polars as pl
+
+# aweme_id layout (most significant bit first):
+#   bits 0-32  : unix timestamp in seconds
+#   bits 32-42 : millisecond slot
+#   bits 42-64 : section
+MILLISECOND_BITS = 10
+SECTION_BITS = 22
+TIMESTAMP_SHIFT = MILLISECOND_BITS + SECTION_BITS
+MILLISECOND_SHIFT = SECTION_BITS
+MILLISECOND_MASK = (1 << MILLISECOND_BITS) - 1
+SECTION_MASK = (1 << SECTION_BITS) - 1
+
+
+def _u64(value):
+    return pl.lit(value, dtype=pl.UInt64)
+
+
+def aweme_id_exprs(column='aweme_id'):
+    """Expressions decoding an aweme_id column into timestamp, millisecond and section"""
+    aweme_id = pl.col(column).cast(pl.UInt64)
+    seconds = aweme_id // _u64(1 << TIMESTAMP_SHIFT)
+    return [
+        seconds.cast(pl.Int64).alias('seconds'),
+        pl.from_epoch(seconds.cast(pl.Int64)).alias('timestamp'),
+        ((aweme_id // _u64(1 << MILLISECOND_SHIFT)) % _u64(1 << MILLISECOND_BITS)).cast(pl.Int64).alias('millisecond'),
+        (aweme_id % _u64(1 << SECTION_BITS)).cast(pl.Int64).alias('section'),
+    ]
+
+
+def decode_aweme_ids(df, column='aweme_id'):
+    """Add seconds, timestamp, millisecond and section columns to a (lazy) frame of aweme_ids"""
+    return df.with_columns(aweme_id_exprs(column))
+
+
+def _as_u64(values):
+    if isinstance(values, int):
+        return _u64(values)
+    return pl.lit(pl.Series(values, dtype=pl.UInt64))
+
+
+def encode_aweme_ids(seconds, milliseconds, sections):
+    """Build aweme_ids (as strings) from second, millisecond and section arrays, scalars are broadcast"""
+    return pl.select(
+        (_as_u64(seconds) * _u64(1 << TIMESTAMP_SHIFT)
+         + _as_u64(milliseconds) * _u64(1 << MILLISECOND_SHIFT)
+         + _as_u64(sections)).cast(pl.String).alias('aweme_id')
+    ).to_series()
+
+
+def encode_aweme_id(seconds, millisecond, section):
+    return str((seconds << TIMESTAMP_SHIFT) | (millisecond << MILLISECOND_SHIFT) | section)
+
+
+def decode_aweme_id(aweme_id):
+    """Return (seconds, millisecond, section) for a single aweme_id"""
+    aweme_id = int(aweme_id)
+    return (
+        aweme_id >> TIMESTAMP_SHIFT,
+        (aweme_id >> MILLISECOND_SHIFT) & MILLISECOND_MASK,
+        aweme_id & SECTION_MASK,
+    )
+
+
+def second_ids(seconds, section, milliseconds=range(1000)):
+    """All aweme_ids for one second of one section, in millisecond order"""
+    base = (seconds << TIMESTAMP_SHIFT) | section
+    return [str(base | (ms << MILLISECOND_SHIFT)) for ms in milliseconds]
+
+
+def format_section(section):
+    return format(section, f'0{SECTION_BITS}b')
+
+
+def section_counts(df, column='aweme_id'):
+    """Number of known aweme_ids per section, most common first"""
+    return df.select((pl.col(column).cast(pl.UInt64) % _u64(1 << SECTION_BITS)).cast(pl.Int64).alias('section'))\
+        .group_by('section')\
+        .agg(pl.len().alias('count'))\
+        .sort('count', descending=True)
+
@@ -0,0 +1,329 @@
+import argparse
+import asyncio
+import collections
+import contextlib
+import datetime
+import importlib
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+import polars as pl
+
+from stand_in_api import StandInProcess, point_endpoints_at, synthetic_aweme
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+# metrics compared between reports, 1 where a larger value is an improvement and -1 where a smaller one is
+COMPARED_METRICS = {
+    'requests_per_s': 1,
+    'elapsed_s': -1,
+    'latency_p50_ms': -1,
+    'latency_p99_ms': -1,
+    'flush_total_ms': -1,
+    'flush_p50_ms': -1,
+    'flush_max_ms': -1,
+    'peak_rss_mb': -1,
+}
+
+
+class Recorder:
+    """Times every request and every flush of the process it is installed in"""
+    def __init__(self):
+        self.latencies = []
+        self.outcomes = collections.Counter()
+        self.flushes = []
+        self.rows_written = 0
+        self.bytes_written = 0
+
+    def wrap_fetch(self, cls, name):
+        original = getattr(cls, name)
+
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                response = await original(*args, **kwargs)
+            except Exception:
+                self.outcomes['error'] += 1
+                raise
+            finally:
+                self.latencies.append(time.perf_counter() - started)
+            self.outcomes['ok' if response else 'empty'] += 1
+            return response
+
+        setattr(cls, name, timed)
+
+    def wrap_flush(self, cls, name, rows):
+        original = getattr(cls, name)
+
+        def timed(store, data, *args, **kwargs):
+            started = time.perf_counter()
+            result = original(store, data, *args, **kwargs)
+            self.flushes.append(time.perf_counter() - started)
+            self.rows_written += rows(data)
+            # a PartStore returns the part it wrote, a SegmentWriter the bytes
+            if isinstance(result, dict):
+                self.bytes_written += result.get('bytes', 0)
+            elif isinstance(result, int):
+                self.bytes_written += result
+            return result
+
+        setattr(cls, name, timed)
+
+    def install(self):
+        from douyin_scraper.base_crawler import BaseCrawler
+        from part_store import PartStore
+        from raw_segments import SegmentWriter
+
+        # every endpoint of the web crawler goes through fetch_get_json
+        self.wrap_fetch(BaseCrawler, 'fetch_get_json')
+        self.wrap_flush(PartStore, 'append', lambda df: df.height)
+        self.wrap_flush(SegmentWriter, 'append_records', len)
+
+    def summary(self, elapsed):
+        latencies = np.array(self.latencies) * 1000
+        flushes = np.array(self.flushes) * 1000
+        requests = len(self.latencies)
+        return {
+            'requests': requests,
+            'ok': self.outcomes['ok'],
+            'empty': self.outcomes['empty'],
+            'errors': self.outcomes['error'],
+            'elapsed_s': elapsed,
+            'requests_per_s': requests / elapsed if elapsed else 0.0,
+            'latency_p50_ms': float(np.percentile(latencies, 50)) if requests else None,
+            'latency_p99_ms': float(np.percentile(latencies, 99)) if requests else None,
+            'flushes': len(self.flushes),
+            'flush_total_ms': float(flushes.sum()),
+            'flush_p50_ms': float(np.percentile(flushes, 50)) if len(flushes) else None,
+            'flush_max_ms': float(flushes.max()) if len(flushes) else None,
+            'rows_written': self.rows_written,
+            'bytes_written': self.bytes_written,
+            # ru_maxrss is in KiB on linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+
+
+def seed_corpus(start, section, n=100):
+    """A small corpus in one section so the samplers pick it as their most common section"""
+    from corpus import VideoCorpus
+
+    corpus = VideoCorpus()
+    corpus.upsert([synthetic_aweme(((start - i) << 32) | ((i % 1000) << 22) | section) for i in range(n)], source='benchmark')
+    corpus.close()
+
+
+def window_args(settings):
+    start = datetime.datetime.fromtimestamp(settings['start'])
+    end = start + datetime.timedelta(seconds=settings['seconds'])
+    return ['--start', start.isoformat(), '--end', end.isoformat()]
+
+
+def setup_sampler(settings):
+    seed_corpus(settings['start'], settings['section'])
+    return window_args(settings)
+
+
+def setup_refresh(settings):
+    # every video is new to the stats series, so all of them are due
+    seed_corpus(settings['start'], settings['section'], n=settings['seconds'] * 1000)
+    return []
+
+
+def setup_users(settings):
+    with open('users.txt', 'w') as f:
+        f.write('\n'.join(f"MS4wLjABAAAAbenchmark{i}" for i in range(settings['users'])))
+    return ['--users', 'users.txt']
+
+
+# scenario name -> (script driven end to end, setup returning its command line)
+SCENARIOS = {
+    'related': ('random_related', setup_sampler),
+    'sample': ('id_sample', setup_sampler),
+    'users': ('scrape_users', setup_users),
+    'refresh': ('re_request_ids', setup_refresh),
+}
+
+
+def _run_scenario(name, settings, base_url, workdir, result_queue):
+    try:
+        sys.path.insert(0, SCRIPTS_DIR)
+        os.chdir(workdir)
+        os.makedirs('./data', exist_ok=True)
+        point_endpoints_at(base_url)
+        if settings['proxies']:
+            # picked up by the scripts' default --proxies
+            with open('./data/proxies.txt', 'w') as f:
+                f.write('\n'.join(settings['proxies']))
+        module_name, setup = SCENARIOS[name]
+        argv = setup(settings)
+        module = importlib.import_module(module_name)
+        recorder = Recorder()
+        recorder.install()
+        sys.argv = [module_name + '.py'] + argv
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            started = time.perf_counter()
+            asyncio.run(module.main())
+            elapsed = time.perf_counter() - started
+    except BaseException as e:
+        result_queue.put({'error': repr(e)})
+        raise
+    result_queue.put(recorder.summary(elapsed))
+
+
+def server_stats(base_url):
+    with urllib.request.urlopen(base_url + '/_stats') as response:
+        return json.load(response)
+
+
+def wait_for_result(process, result_queue, timeout):
+    """Result the scenario process puts on the queue, or an error if it dies or runs past timeout without one"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return result_queue.get(timeout=1.0)
+        except queue.Empty:
+            pass
+        if not process.is_alive():
+            # the result may still be in flight from the queue's feeder thread when the process exits
+            try:
+                return result_queue.get(timeout=1.0)
+            except queue.Empty:
+                return {'error': f"scenario process exited with code {process.exitcode} without a result"}
+        if time.monotonic() > deadline:
+            process.terminate()
+            return {'error': f"scenario timed out after {timeout:.0f} s"}
+
+
+def run_scenario(name, settings, server, keep=False, timeout=600.0):
+    """Run one scenario in a fresh process and working directory, so RSS and disk state are its own"""
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    workdir = tempfile.mkdtemp(prefix=f"benchmark-{name}-")
+    stats_before = server_stats(server.base_url)
+    process = context.Process(target=_run_scenario, args=(name, settings, server.base_url, workdir, result_queue))
+    process.start()
+    try:
+        result = wait_for_result(process, result_queue, timeout)
+    finally:
+        process.join()
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    stats_after = server_stats(server.base_url)
+    result['server'] = {key: value - stats_before.get(key, 0) for key, value in stats_after.items()}
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    """Relative change of every metric against a previous report"""
+    rows = []
+    for name, result in report['scenarios'].items():
+        base_result = baseline['scenarios'].get(name)
+        if base_result is None:
+            continue
+        for metric, direction in COMPARED_METRICS.items():
+            value = result.get(metric)
+            base_value = base_result.get(metric)
+            if value is None or not base_value:
+                continue
+            change = (value - base_value) / base_value
+            better = change * direction > 0
+            rows.append({'scenario': name, 'metric': metric, 'baseline': float(base_value), 'current': float(value),
+                         'change': change, 'better': better})
+    return pl.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scrapers against a local stand-in for the Douyin API")
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--fixtures', help="raw segments directory whose responses are replayed")
+    parser.add_argument('--seconds', type=int, default=2, help="seconds of ids probed by the samplers, 1000 requests each, and thousands of videos refreshed")
+    parser.add_argument('--users', type=int, default=50, help="timelines paged by the user crawler")
+    parser.add_argument('--posts-per-user', type=int, default=100)
+    parser.add_argument('--hit-rate', type=float, default=0.05, help="share of probed ids that exist")
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--jitter-ms', type=float, default=5)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests answered with a 500")
+    parser.add_argument('--throttle-rps', type=float, default=None,
+                        help="requests per second served before bodies come back empty, per proxy when there are proxies")
+    parser.add_argument('--proxies', type=int, default=0, help="stand-in proxies the scenarios spread their requests over")
+    parser.add_argument('--out', default=None, help="report path, defaults to ./data/benchmarks/<time>.json")
+    parser.add_argument('--baseline', default=None, help="previous report to compare against")
+    parser.add_argument('--keep', action='store_true', help="keep the scenario working directories")
+    parser.add_argument('--timeout', type=float, default=600.0, help="seconds a scenario may run before it is reported as failed")
+    args = parser.parse_args()
+
+    settings = {
+        'start': int(datetime.datetime(2025, 6, 1, 10, 0, 0).timestamp()),
+        'section': 12345,
+        'seconds': args.seconds,
+        'users': args.users,
+    }
+    server_settings = {
+        'segments_path': os.path.abspath(args.fixtures) if args.fixtures else None,
+        'hit_rate': args.hit_rate,
+        'posts_per_user': args.posts_per_user,
+        'latency_ms': args.latency_ms,
+        'jitter_ms': args.jitter_ms,
+        'error_rate': args.error_rate,
+        'throttle_rps': args.throttle_rps,
+        'num_proxies': args.proxies,
+    }
+    report = {
+        'commit': git_commit(),
+        'created_at': datetime.datetime.now().isoformat(),
+        'settings': dict(settings, **server_settings),
+        'scenarios': {},
+    }
+    failed = []
+    with StandInProcess(**server_settings) as server:
+        settings['proxies'] = server.proxy_urls
+        for name in args.scenarios:
+            print(f"Running {name}...")
+            report['scenarios'][name] = result = run_scenario(name, settings, server, keep=args.keep, timeout=args.timeout)
+            if 'error' in result:
+                print(f"{name} failed: {result['error']}")
+                failed.append(name)
+                continue
+            if not result['bytes_written']:
+                # every scenario stores what it fetched, so the recorder missed its writer
+                print(f"{name} failed: no bytes written")
+                failed.append(name)
+            print(f"{name}: {result['requests_per_s']:.1f} req/s, p50 {result['latency_p50_ms'] or 0:.1f} ms, "
+                  f"p99 {result['latency_p99_ms'] or 0:.1f} ms, flushes {result['flush_total_ms']:.1f} ms, "
+                  f"peak rss {result['peak_rss_mb']:.0f} MB")
+
+    out_path = args.out or f"./data/benchmarks/{datetime.datetime.now():%Y%m%d-%H%M%S}.json"
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    with open(out_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {out_path}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        with pl.Config(tbl_rows=-1):
+            print(compare(report, baseline))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # the scenarios get TQDM_DISABLE through the spawned processes' environment
+    os.environ.setdefault('TQDM_DISABLE', '1')
+    main()
@@ -0,0 +1,167 @@
+import argparse
+import asyncio
+import json
+import math
+import socket
+import sys
+import time
+import urllib.request
+
+from proxy_pool import PooledDouyinCrawler, ProxyPool
+from stand_in_api import StandInProcess, point_endpoints_at
+
+
+def unused_proxy_url():
+    """Url of a local port nothing listens on, a proxy that refuses every connection"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+def server_stats(base_url):
+    with urllib.request.urlopen(base_url + '/_stats') as response:
+        return json.load(response)
+
+
+def watch_releases(pool, on_release):
+    """Call on_release(state, cooldown) after every release, cooldown being the seconds it was just benched for"""
+    release = pool.release
+
+    def watched(state, ok, latency):
+        cooldown_until = state.cooldown_until
+        release(state, ok, latency)
+        on_release(state, state.cooldown_until - time.monotonic() if state.cooldown_until != cooldown_until else None)
+
+    pool.release = watched
+
+
+async def send(crawler, n, concurrency=1):
+    """n detail requests, failures are expected and ignored"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            try:
+                await crawler.fetch_one_video(str(7000000000000000000 + i))
+            except Exception:
+                pass
+
+    await asyncio.gather(*(one(i) for i in range(n)))
+
+
+async def check_choice(server, n=20000):
+    """Each request goes to the better of two random proxies, so the k-th best of m gets (m - k) / C(m, 2) of them"""
+    async with ProxyPool(server.proxy_urls, seed=0) as pool:
+        for rank, state in enumerate(pool.states):
+            state.requests, state.latency = 1, 0.01 * (rank + 1)
+        picks = [0] * len(pool.states)
+        for _ in range(n):
+            state = await pool.acquire()
+            state.in_flight -= 1
+            picks[pool.states.index(state)] += 1
+    m = len(picks)
+    expected = [(m - 1 - rank) / math.comb(m, 2) for rank in range(m)]
+    shares = [count / n for count in picks]
+    print(f"choice: shares {[round(share, 3) for share in shares]}, expected {[round(share, 3) for share in expected]}")
+    failures = []
+    if picks[-1]:
+        failures.append(f"the worst proxy was picked {picks[-1]} times")
+    if any(abs(share - expected_share) > 0.02 for share, expected_share in zip(shares, expected)):
+        failures.append("shares differ from the power of two choices")
+    return failures
+
+
+async def check_cooldown(seconds):
+    """A failing proxy is benched for a jittered cooldown that doubles with every bench, up to max_cooldown"""
+    cooldown, max_cooldown = 0.1, 0.8
+    # two failing proxies, so one of them can always be benched
+    pool = ProxyPool([unused_proxy_url(), unused_proxy_url()], cooldown=cooldown, max_cooldown=max_cooldown,
+                     failures_before_cooldown=2, seed=0)
+    benched = {}
+    watch_releases(pool, lambda state, benched_for: benched_for is not None and benched.setdefault(state.label, []).append(benched_for))
+    async with pool:
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            await send(PooledDouyinCrawler(pool), 10)
+    failures = []
+    for label, durations in benched.items():
+        print(f"cooldown: {label} benched for {[round(benched_for, 3) for benched_for in durations]} s")
+        for attempt, benched_for in enumerate(durations):
+            full = min(max_cooldown, cooldown * 2 ** attempt)
+            # jitter takes up to half of the cooldown off, the rest allows for the time since the release
+            if not 0.5 * full - 0.01 <= benched_for <= full:
+                failures.append(f"cooldown {attempt} of {label} lasted {benched_for:.3f} s, outside [{0.5 * full:.3f}, {full:.3f}]")
+    if not any(min(max_cooldown, cooldown * 2 ** (len(durations) - 1)) == max_cooldown for durations in benched.values()):
+        failures.append("no failing proxy was benched often enough to reach max_cooldown")
+    return failures
+
+
+async def check_last_proxy(n=200):
+    """With every proxy failing, one is always left available rather than the pool stalling"""
+    failures = []
+    for num_proxies in (1, 2, 3):
+        pool = ProxyPool([unused_proxy_url() for _ in range(num_proxies)], cooldown=60.0, failures_before_cooldown=1, seed=0)
+        least_available = [num_proxies]
+        watch_releases(pool, lambda state, benched_for: least_available.append(pool.available()))
+        async with pool:
+            started = time.monotonic()
+            await send(PooledDouyinCrawler(pool), n, concurrency=8)
+            elapsed = time.monotonic() - started
+        print(f"last proxy: {num_proxies} failing proxies, at least {min(least_available)} available, {n} requests in {elapsed:.1f} s")
+        if min(least_available) < 1:
+            failures.append(f"every one of {num_proxies} failing proxies was benched")
+        if elapsed > 30:
+            failures.append(f"requests through {num_proxies} failing proxies waited on cooldowns")
+    return failures
+
+
+async def check_connection_reuse(server, n=2000, connections_per_proxy=4):
+    """Every proxy keeps its own few connections alive, rather than one connection per request"""
+    before = server_stats(server.base_url)
+    async with ProxyPool(server.proxy_urls, connections_per_proxy=connections_per_proxy, seed=0) as pool:
+        await send(PooledDouyinCrawler(pool), n, concurrency=len(server.proxy_urls) * connections_per_proxy)
+        report = pool.report()
+    after = server_stats(server.base_url)
+    failures = []
+    if report['failures'].sum() or report['cooldown_s'].max() > 0:
+        failures.append("a healthy proxy failed or was benched")
+    for i in range(len(server.proxy_urls)):
+        requests = after.get(f"proxy{i}.requests", 0) - before.get(f"proxy{i}.requests", 0)
+        connections = after.get(f"proxy{i}.connections", 0) - before.get(f"proxy{i}.connections", 0)
+        print(f"connection reuse: proxy{i} served {requests} requests over {connections} connections")
+        if requests == 0:
+            failures.append(f"proxy{i} got no requests")
+        if connections > connections_per_proxy:
+            failures.append(f"proxy{i} opened {connections} connections, more than its {connections_per_proxy}")
+    return failures
+
+
+async def run_checks(args, server):
+    failures = []
+    failures += await check_choice(server)
+    failures += await check_cooldown(args.seconds)
+    failures += await check_last_proxy()
+    failures += await check_connection_reuse(server)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the proxy pool against stand-in proxies: power of two choices, "
+                                                 "cooldown schedule, the last proxy never benched and connection reuse")
+    parser.add_argument('--proxies', type=int, default=4, help="stand-in proxies, at least 2")
+    parser.add_argument('--seconds', type=float, default=5.0, help="seconds the failing proxies are exercised for the cooldown check")
+    args = parser.parse_args()
+
+    with StandInProcess(latency_ms=2, num_proxies=args.proxies) as server:
+        point_endpoints_at(server.base_url)
+        failures = asyncio.run(run_checks(args, server))
+    if failures:
+        for failure in failures:
+            print(f"FAILED: {failure}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import urllib.request
+
+from fetch_engine import PostDetailEngine
+from part_store import PartStore
+from shards import ShardCoordinator, crawl_shards, verify_coverage
+from stand_in_api import StandInProcess, point_endpoints_at
+
+SECTIONS = [12345, 54321]
+
+
+async def crawl(args, workdir):
+    owner = f"{socket.gethostname()}-{os.getpid()}"
+    coordinator = ShardCoordinator(os.path.join(workdir, 'shards.sqlite'), lease_seconds=args.lease_seconds)
+    store = PartStore(os.path.join(workdir, 'store'))
+    stall_marker = os.path.join(workdir, 'stalled')
+    first_id = None
+    try:
+        async with PostDetailEngine(concurrency=args.concurrency) as engine:
+            async def fetch(aweme_id):
+                nonlocal first_id
+                first_id = first_id or aweme_id
+                # exactly one worker, across all processes, stalls past its lease on its first shard
+                if aweme_id == first_id and not os.path.exists(stall_marker):
+                    try:
+                        os.close(os.open(stall_marker, os.O_CREAT | os.O_EXCL))
+                    except FileExistsError:
+                        pass
+                    else:
+                        print(f"{owner} - Stalling {args.lease_seconds * 3} s on {aweme_id}")
+                        await asyncio.sleep(args.lease_seconds * 3)
+                return await engine.fetch(aweme_id)
+
+            await crawl_shards(coordinator, owner, fetch, store, concurrency=args.concurrency,
+                               batch_size=args.batch_size, milliseconds=args.milliseconds, max_attempts=args.max_attempts)
+    finally:
+        coordinator.close()
+
+
+def worker_main(args, workdir, base_url):
+    point_endpoints_at(base_url)
+    asyncio.run(crawl(args, workdir))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl shards with several processes against the stand-in API while "
+                                                 "one worker outlives its lease and requests fail, then check every id was recorded exactly once")
+    parser.add_argument('--processes', type=int, default=3)
+    parser.add_argument('--seconds', type=int, default=12, help="seconds of ids planned per section")
+    parser.add_argument('--shard-seconds', type=int, default=4)
+    parser.add_argument('--milliseconds', type=int, default=100, help="millisecond slots probed per second")
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--lease-seconds', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--error-rate', type=float, default=0.1, help="share of requests the stand-in fails, they are retried")
+    parser.add_argument('--max-attempts', type=int, default=8)
+    parser.add_argument('--keep', action='store_true', help="keep the working directory")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='shard-leases-')
+    coordinator = ShardCoordinator(os.path.join(workdir, 'shards.sqlite'), lease_seconds=args.lease_seconds)
+    start = 1748772000
+    coordinator.plan(SECTIONS, start, start + args.seconds, shard_seconds=args.shard_seconds)
+
+    with StandInProcess(latency_ms=1, error_rate=args.error_rate) as server:
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=worker_main, args=(args, workdir, server.base_url)) for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        with urllib.request.urlopen(server.base_url + '/_stats') as response:
+            errors = json.load(response).get('errors', 0)
+
+    progress = coordinator.progress()
+    reclaimed = coordinator.conn.execute('SELECT COUNT(*) FROM shards WHERE claims > 1').fetchone()[0]
+    duplicates, missing = verify_coverage(coordinator, PartStore(os.path.join(workdir, 'store')), milliseconds=args.milliseconds)
+    coordinator.close()
+    print(f"Shards: {progress}, reclaimed after an expired lease: {reclaimed}")
+    print(f"Duplicate ids: {duplicates}, missing ids: {missing}, failed requests: {errors}")
+    if args.keep:
+        print(f"Working directory: {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    failures = []
+    if progress.get('done', 0) != len(SECTIONS) * -(-args.seconds // args.shard_seconds):
+        failures.append("not every shard is done")
+    if reclaimed == 0:
+        failures.append("no lease expired, the stalled worker did not outlive its lease")
+    if duplicates or missing:
+        failures.append("ids were recorded twice or not at all")
+    if args.error_rate and errors == 0:
+        failures.append("no request failed, the retries were not exercised")
+    if any(process.exitcode != 0 for process in processes):
+        failures.append("a worker process failed")
+    if failures:
+        print(f"FAILED: {', '.join(failures)}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import asyncio
+import collections
+import contextlib
+import time
+
+
+class AIMDLimiter:
+    """Adaptive in-flight request limit using additive increase / multiplicative decrease.
+
+    The limit grows by `increase` after every `limit` healthy requests, i.e. roughly once per
+    round of requests, and is multiplied by `decrease` when a request fails, comes back empty or
+    takes more than `spike_factor` times the smoothed baseline latency. At most one decrease is
+    applied per round so a burst of failures from requests already in flight counts once.
+    """
+    def __init__(self, initial=8, floor=1, ceiling=64, increase=1, decrease=0.5, spike_factor=3.0, smoothing=0.1):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.increase = increase
+        self.decrease = decrease
+        self.spike_factor = spike_factor
+        self.smoothing = smoothing
+        self._limit = float(min(max(initial, floor), ceiling))
+        self.in_flight = 0
+        self.baseline_latency = None
+        self.successes = 0
+        self.failures = collections.Counter()
+        self._healthy_in_round = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def set_bounds(self, floor=None, ceiling=None):
+        if floor is not None:
+            self.floor = floor
+        if ceiling is not None:
+            self.ceiling = ceiling
+        self._limit = float(min(max(self._limit, self.floor), self.ceiling))
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency):
+        self.successes += 1
+        if self.baseline_latency is None:
+            self.baseline_latency = latency
+        spike = latency > self.baseline_latency * self.spike_factor
+        # keep following the latency so a lasting shift stops counting as a spike
+        self.baseline_latency += self.smoothing * (latency - self.baseline_latency)
+        if spike:
+            self.on_failure('latency')
+            return
+
+        self._healthy_in_round += 1
+        if self._healthy_in_round >= self.limit:
+            self._healthy_in_round = 0
+            self._limit = min(self._limit + self.increase, self.ceiling)
+
+    def on_failure(self, reason='error'):
+        self.failures[reason] += 1
+        self._healthy_in_round = 0
+        now = time.monotonic()
+        round_time = self.baseline_latency or 0.0
+        if now - self._last_decrease < round_time:
+            return
+        self._last_decrease = now
+        self._limit = max(self._limit * self.decrease, self.floor)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Hold one in-flight slot, failures are recorded from exceptions or slot.fail()"""
+        await self.acquire()
+        slot = _Slot()
+        start = time.monotonic()
+        try:
+            yield slot
+        except Exception:
+            self.on_failure('error')
+            raise
+        else:
+            if slot.failure is not None:
+                self.on_failure(slot.failure)
+            else:
+                self.on_success(time.monotonic() - start)
+        finally:
+            await self.release()
+
+
+class _Slot:
+    def __init__(self):
+        self.failure = None
+
+    def fail(self, reason):
+        self.failure = reason
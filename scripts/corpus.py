@@ -0,0 +1,168 @@
+import os
+import time
+
+import polars as pl
+
+from part_store import PartStore
+from probe_index import load_probe_index
+from raw_segments import AWEME
+from section_catalog import load_section_catalog
+from writer import BatchWriter
+
+CORPUS_PATH = './data/douyin_related_videos'
+LEGACY_CORPUS_PATH = './data/douyin_related_videos.parquet.zstd'
+SIGHTING_SCHEMA = {'aweme_id': pl.String, 'seen_at': pl.Float64, 'source': pl.String}
+
+
+class VideoCorpus:
+    """Append-only video corpus with a persistent id index and a log of repeat sightings.
+
+    Videos are written once, the first time they are seen. Every later sighting only appends a
+    small (aweme_id, seen_at, source) row, so merging new results costs time proportional to the
+    new data rather than to the corpus.
+    """
+    def __init__(self, path=CORPUS_PATH, legacy_path=LEGACY_CORPUS_PATH, tagger=None):
+        self.path = path
+        self.tagger = tagger
+        self.store = PartStore(path, auto_compact=True)
+        # the single-file corpus written before the store existed becomes its first part, projected
+        # to the flat columns every later part has
+        if not self.store.parts() and os.path.exists(legacy_path):
+            self.store.append(AWEME.project_frame(pl.read_parquet(legacy_path)))
+        # stores that imported it as it was, nested, are migrated once
+        self.store.rewrite(AWEME.project_frame, lambda schema: dict(schema) != AWEME.schema)
+        self.sightings = PartStore(path + '_sightings', auto_compact=True)
+        self._index = None
+        self._catalog = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = load_probe_index(self.path + '_index', self.store)
+        return self._index
+
+    @property
+    def catalog(self):
+        if self._catalog is None:
+            self._catalog = load_section_catalog(self.path + '_catalog', self.store)
+        return self._catalog
+
+    def scan(self, columns=None):
+        return self.store.scan(columns)
+
+    def __contains__(self, aweme_id):
+        return aweme_id in self.index
+
+    def _split(self, items, source, pending=()):
+        """Flattened unseen videos, their ids and a sighting row for every item"""
+        seen_at = time.time()
+        new_items = []
+        new_ids = set()
+        sightings = []
+        for item in items:
+            aweme_id = item.get('aweme_id')
+            if not aweme_id:
+                continue
+            sightings.append({'aweme_id': aweme_id, 'seen_at': seen_at, 'source': source})
+            if aweme_id in new_ids or aweme_id in pending or aweme_id in self.index:
+                continue
+            new_ids.add(aweme_id)
+            # only the projected fields are kept, as typed flat columns
+            new_items.append(AWEME.flatten(item))
+        return new_items, new_ids, sightings
+
+    def _append(self, new_items, sightings):
+        # videos first, so a crash in between can at worst store a video twice, never lose one
+        if new_items:
+            self.store.append(pl.DataFrame(new_items, schema=AWEME.schema, strict=False))
+        if self.tagger is not None:
+            self.tagger.tag_records(new_items)
+        if sightings:
+            self.sightings.append(pl.DataFrame(sightings, schema=SIGHTING_SCHEMA))
+
+    def _register(self, new_ids):
+        self.index.add(list(new_ids))
+        self.catalog.add(new_ids)
+
+    def upsert(self, items, source=None):
+        """Append unseen videos and record a sighting for every item, returns the number of new videos"""
+        # opened before the append, a catalog built from the store must not count this batch twice
+        self.catalog
+        new_items, new_ids, sightings = self._split(items, source)
+        self._append(new_items, sightings)
+        self._register(new_ids)
+        return len(new_items)
+
+    def last_seen(self):
+        """First and last time each video was seen and how often"""
+        return self.sightings.scan()\
+            .group_by('aweme_id')\
+            .agg(
+                pl.col('seen_at').min().alias('first_seen'),
+                pl.col('seen_at').max().alias('last_seen'),
+                pl.len().alias('times_seen'),
+            )
+
+    def close(self):
+        if self._index is not None:
+            self._index.checkpoint()
+        if self._catalog is not None:
+            self._catalog.checkpoint()
+        self.store.wait_for_compaction()
+        self.sightings.wait_for_compaction()
+        if self.tagger is not None:
+            self.tagger.store.wait_for_compaction()
+
+
+class CorpusWriter:
+    """Upserts into a VideoCorpus from the event loop, written per batch on a BatchWriter thread.
+
+    upsert() only flattens the unseen videos and queues them with their sightings, the parquet
+    parts are written once per batch off the loop. Videos are added to the index when their batch
+    is written; until then a later sighting of one is recognised through the ids still pending.
+    `on_written(sources)` is called on the loop with the sources of every written batch, so a
+    caller only considers a source done once its videos are on disk.
+    """
+    def __init__(self, corpus, batch_size=256, max_latency=5.0, on_written=None):
+        self.corpus = corpus
+        self.on_written = on_written
+        self.pending = set()
+        self.writer = BatchWriter(self._write, on_written=self._written, on_failed=self._failed,
+                                  batch_size=batch_size, max_latency=max_latency)
+
+    def start(self):
+        # opened before anything is written, a catalog built from the store must not count a batch twice
+        self.corpus.index
+        self.corpus.catalog
+        self.writer.start()
+        return self
+
+    async def upsert(self, items, source=None):
+        """Queue unseen videos and a sighting for every item, returns the number of new videos"""
+        new_items, new_ids, sightings = self.corpus._split(items, source, self.pending)
+        self.pending |= new_ids
+        await self.writer.put((new_items, new_ids, sightings, source))
+        return len(new_items)
+
+    def _write(self, batch):
+        self.corpus._append(
+            [item for new_items, _, _, _ in batch for item in new_items],
+            [sighting for _, _, sightings, _ in batch for sighting in sightings],
+        )
+
+    def _batch_ids(self, batch):
+        return set().union(*(new_ids for _, new_ids, _, _ in batch))
+
+    def _written(self, batch):
+        new_ids = self._batch_ids(batch)
+        self.corpus._register(new_ids)
+        self.pending -= new_ids
+        if self.on_written is not None:
+            self.on_written([source for _, _, _, source in batch])
+
+    def _failed(self, batch):
+        # not stored, so the next sighting of these videos stores them
+        self.pending -= self._batch_ids(batch)
+
+    async def close(self):
+        await self.writer.close()
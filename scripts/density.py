@@ -0,0 +1,138 @@
+import os
+import random
+
+import numpy as np
+import polars as pl
+
+from aweme_ids import decode_aweme_id, encode_aweme_id
+
+SECONDS_PER_HOUR = 3600
+SECONDS_PER_DAY = 24 * SECONDS_PER_HOUR
+MS_BUCKET = 50
+
+
+def build_prior(catalog, n_sections=16):
+    """Hour of day, millisecond slot and section histograms of the known ids in a SectionCatalog"""
+    histograms = catalog.histograms()
+    counts = catalog.section_counts().head(n_sections)
+    return (
+        histograms['hour'],
+        histograms['millisecond'][:1000],
+        dict(zip(counts['section'].to_list(), counts['count'].to_list())),
+    )
+
+
+class DensityScheduler:
+    """Orders probes by the expected chance of hitting a real video.
+
+    The id space is split into regions of (section, hour of day, 50ms bucket). Each region has a
+    Beta prior whose mean is proportional to the product of the known ids' section, hour and
+    millisecond densities; probe outcomes update it. Regions are picked by Thompson sampling,
+    so dense regions are probed first while sparse ones still get explored occasionally.
+    """
+    def __init__(self, hours, milliseconds, sections, start, end, base_rate=0.01, prior_strength=50, stats_path=None, seed=None):
+        self.start = start
+        self.end = end
+        self.stats_path = stats_path
+        self.rng = random.Random(seed)
+        self.np_rng = np.random.default_rng(seed)
+
+        hour_density = np.asarray(hours, dtype=float) + 1
+        hour_density /= hour_density.mean()
+        buckets = np.add.reduceat(np.asarray(milliseconds, dtype=float), np.arange(0, 1000, MS_BUCKET)) + 1
+        bucket_density = buckets / buckets.mean()
+        section_list = list(sections)
+        section_density = np.asarray([sections[s] for s in section_list], dtype=float) + 1
+        section_density /= section_density.mean()
+
+        self.regions = [
+            (section, hour, bucket)
+            for section in section_list
+            for hour in range(24)
+            for bucket in range(len(bucket_density))
+        ]
+        self.region_ids = {region: i for i, region in enumerate(self.regions)}
+        prior = np.einsum('s,h,b->shb', section_density, hour_density, bucket_density).ravel() * base_rate
+        prior = np.clip(prior, 1e-6, 0.99)
+        self.alpha = prior * prior_strength
+        self.beta = (1 - prior) * prior_strength
+        self.hits = np.zeros(len(self.regions), dtype=np.int64)
+        self.probes = np.zeros(len(self.regions), dtype=np.int64)
+        self.exhausted = np.zeros(len(self.regions), dtype=bool)
+        self.in_flight = set()
+        self._load_stats()
+
+    def _load_stats(self):
+        if self.stats_path is None or not os.path.exists(self.stats_path):
+            return
+        stats = pl.read_parquet(self.stats_path)
+        for row in stats.iter_rows(named=True):
+            i = self.region_ids.get((row['section'], row['hour'], row['bucket']))
+            if i is not None:
+                self.hits[i] = row['hits']
+                self.probes[i] = row['probes']
+
+    def region_of(self, aweme_id):
+        seconds, millisecond, section = decode_aweme_id(aweme_id)
+        hour = (seconds % SECONDS_PER_DAY) // SECONDS_PER_HOUR
+        return self.region_ids.get((section, hour, millisecond // MS_BUCKET))
+
+    def _candidate(self, region, index, attempts=32):
+        section, hour, bucket = self.regions[region]
+        first_day = self.start // SECONDS_PER_DAY
+        last_day = (self.end - 1) // SECONDS_PER_DAY
+        for _ in range(attempts):
+            day = self.rng.randint(first_day, last_day)
+            seconds = day * SECONDS_PER_DAY + hour * SECONDS_PER_HOUR + self.rng.randrange(SECONDS_PER_HOUR)
+            if not self.start <= seconds < self.end:
+                continue
+            millisecond = bucket * MS_BUCKET + self.rng.randrange(MS_BUCKET)
+            aweme_id = encode_aweme_id(seconds, millisecond, section)
+            if aweme_id not in self.in_flight and aweme_id not in index:
+                return aweme_id
+        return None
+
+    def ids(self, index, per_draw=8):
+        """Stream of unprobed ids, highest expected hit rate first, ends when every region is exhausted"""
+        while not self.exhausted.all():
+            samples = self.np_rng.beta(self.alpha + self.hits, self.beta + self.probes - self.hits)
+            samples[self.exhausted] = -1
+            region = int(np.argmax(samples))
+            for _ in range(per_draw):
+                aweme_id = self._candidate(region, index)
+                if aweme_id is None:
+                    # the region is (nearly) fully probed inside the window
+                    self.exhausted[region] = True
+                    break
+                self.in_flight.add(aweme_id)
+                yield aweme_id
+
+    def record(self, aweme_id, hit):
+        """Count a hit or miss, throttled or failed probes say nothing about the region"""
+        self.in_flight.discard(aweme_id)
+        region = self.region_of(aweme_id)
+        if region is None:
+            return
+        self.probes[region] += 1
+        self.hits[region] += int(hit)
+
+    def release(self, aweme_id):
+        """Forget an id that was given up on without an outcome"""
+        self.in_flight.discard(aweme_id)
+
+    def report(self):
+        """Hits, probes and hit rate per probed region, best first"""
+        sections, hours, buckets = zip(*self.regions)
+        return pl.DataFrame({
+            'section': sections,
+            'hour': hours,
+            'bucket': buckets,
+            'hits': self.hits,
+            'probes': self.probes,
+        }).filter(pl.col('probes') > 0)\
+            .with_columns((pl.col('hits') / pl.col('probes')).alias('hit_rate'))\
+            .sort('hit_rate', descending=True)
+
+    def save(self):
+        if self.stats_path is not None:
+            self.report().write_parquet(self.stats_path)
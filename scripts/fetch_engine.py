@@ -0,0 +1,156 @@
+import asyncio
+from urllib.parse import urlencode
+
+from douyin_scraper.douyin.web.endpoints import DouyinAPIEndpoints
+from douyin_scraper.douyin.web.models import PostDetail
+from douyin_scraper.douyin.web.utils import BogusManager
+
+from metrics import Metrics
+from probe_ledger import ProbeLedger
+from proxy_pool import ProxyPool
+from writer import BatchWriter
+
+
+class PostDetailEngine:
+    """Fetches post details for a stream of aweme_ids over a pool of reused connections.
+
+    Up to `concurrency` requests are in flight at once and results are appended to a
+    PartStore or SegmentWriter by a BatchWriter thread, every `batch_size` responses or
+    `max_latency` seconds, whichever comes first. Requests are spread over `proxies`
+    by a ProxyPool, or all go through the configured proxy if there are none.
+    """
+    def __init__(self, concurrency=16, batch_size=256, max_latency=5.0, proxies=None, metrics=None, retry_workers=None):
+        self.concurrency = concurrency
+        self.retry_workers = retry_workers or max(1, concurrency // 4)
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.proxies = proxies
+        self.metrics = metrics
+        self.pool = None
+
+    async def open(self):
+        # clients for the whole run so connections are reused between requests
+        self.pool = ProxyPool(self.proxies, connections_per_proxy=self.concurrency, metrics=self.metrics)
+        await self.pool.open()
+        params = PostDetail(aweme_id='')
+        self.params_dict = params.dict()
+        self.params_dict["msToken"] = ''
+        self.a_bogus = BogusManager.ab_model_2_endpoint(self.params_dict, self.pool.headers["User-Agent"])
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def endpoint(self, aweme_id):
+        params_dict = dict(self.params_dict, aweme_id=aweme_id)
+        return f"{DouyinAPIEndpoints.POST_DETAIL}?{urlencode(params_dict)}&a_bogus={self.a_bogus}"
+
+    async def fetch(self, aweme_id):
+        return await self.pool.fetch_get_json(self.endpoint(aweme_id))
+
+    async def run(self, aweme_ids, store, index=None, frontier=None, on_response=None, pbar=None, metrics=None, outcomes=None,
+                  flatten=None, retries=None, on_abandon=None):
+        """Fetch every id from the (possibly endless) iterable and stream the results into store
+
+        on_response(aweme_id, response) is called for every hit or miss, on_abandon(aweme_id) for
+        every id that failed and will not be tried again. With outcomes, only
+        hits are written to store and every other probe is recorded as a status code. flatten, e.g.
+        raw_segments.flatten_response, reduces each response before it is buffered. With a
+        RetryScheduler, failed ids are retried by `retry_workers` workers of their own and ids
+        that are dead-lettered are no longer re-issued by the frontier.
+        """
+        metrics = metrics or Metrics()
+        work_queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        metrics.gauge('queue_depth', work_queue.qsize, queue='work')
+
+        def write(batch):
+            # misses come through as (aweme_id, None), they only need recording
+            records = [record for _, record in batch if record is not None]
+            if not records:
+                return
+            with metrics.timer('flush_seconds', stage='store'):
+                written = store.append_records(records)
+            # a PartStore returns the part it wrote, a SegmentWriter the bytes
+            num_bytes = written['bytes'] if isinstance(written, dict) else written or 0
+            metrics.inc('records_written_total', len(records))
+            metrics.inc('bytes_written_total', num_bytes)
+
+        ledger = ProbeLedger(index, outcomes, frontier, retries, metrics, on_abandon)
+
+        def on_written(batch):
+            ledger.written([(aweme_id, 'miss' if record is None else 'hit') for aweme_id, record in batch])
+
+        writer = BatchWriter(write, on_written=on_written, batch_size=self.batch_size, max_latency=self.max_latency).start()
+        metrics.gauge('queue_depth', writer.qsize, queue='results')
+
+        async def producer():
+            for aweme_id in aweme_ids:
+                await work_queue.put(aweme_id)
+            for _ in range(self.concurrency):
+                await work_queue.put(None)
+
+        async def probe(aweme_id):
+            try:
+                with metrics.timer('fetch_seconds', endpoint='detail'):
+                    response = await self.fetch(aweme_id)
+                status = 'empty' if not response else 'hit' if response.get('aweme_detail') else 'miss'
+                metrics.inc('probes_total', outcome=status)
+                if on_response is not None and status != 'empty':
+                    on_response(aweme_id, response)
+                if status == 'empty' and (outcomes is not None or retries is not None):
+                    # throttled, worth another try
+                    ledger.failed(aweme_id, status)
+                    return
+                if outcomes is None or status == 'hit':
+                    await writer.put((aweme_id, {
+                        'aweme_id': aweme_id,
+                        'result': response if flatten is None else flatten(response)
+                    }))
+                else:
+                    await writer.put((aweme_id, None))
+                ledger.succeeded(aweme_id)
+            except Exception as e:
+                metrics.inc('probes_total', outcome='error')
+                metrics.inc('fetch_errors_total', type=type(e).__name__)
+                ledger.failed(aweme_id, 'error', repr(e))
+                print(f"Error fetching data for video ID {aweme_id}: {e}")
+            finally:
+                if pbar is not None:
+                    pbar.update(1)
+
+        async def worker():
+            while True:
+                aweme_id = await work_queue.get()
+                if aweme_id is None:
+                    return
+                await probe(aweme_id)
+
+        async def retry_worker():
+            async for aweme_id in retries.due():
+                await probe(aweme_id)
+
+        tasks = [asyncio.create_task(producer())] + [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        retry_tasks = []
+        if retries is not None:
+            metrics.gauge('retries_pending', retries.pending)
+            retry_tasks = [asyncio.create_task(retry_worker()) for _ in range(self.retry_workers)]
+        try:
+            await asyncio.gather(*tasks)
+            if retries is not None:
+                # fresh ids are done, wait for the retries to succeed or run out of attempts
+                retries.close()
+                await asyncio.gather(*retry_tasks)
+        finally:
+            for task in tasks + retry_tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, *retry_tasks, return_exceptions=True)
+            await writer.close()
+            ledger.flush_dead_letters()
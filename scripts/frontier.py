@@ -0,0 +1,109 @@
+import json
+import os
+
+from aweme_ids import decode_aweme_id, encode_aweme_id
+
+
+class Frontier:
+    """Durable generator position per section so a restarted crawl picks up where it stopped.
+
+    For every section it keeps the last second whose ids have all been resolved, plus the ids
+    that failed, which are re-issued first on the next run. Ids of seconds after the completed
+    one that were still in flight are covered by resuming at completed + 1.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.completed = {}
+        self.gaps = {}
+        self._pending = {}
+        self._issued = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                state = json.load(f)
+            for section, section_state in state['sections'].items():
+                if section_state['completed'] is not None:
+                    self.completed[int(section)] = section_state['completed']
+                self.gaps[int(section)] = set(section_state['gaps'])
+
+    def resume_second(self, section, start=None):
+        """First second to generate for section, never before start when it is given"""
+        if section in self.completed:
+            resume = self.completed[section] + 1
+            return resume if start is None else max(resume, start)
+        return start
+
+    def issue(self, aweme_id):
+        seconds, _, section = decode_aweme_id(aweme_id)
+        if aweme_id in self.gaps.get(section, ()):
+            return
+        key = (section, seconds)
+        self._pending[key] = self._pending.get(key, 0) + 1
+
+    def close_second(self, section, seconds):
+        """Every id of this second has been issued"""
+        self._issued[section] = seconds
+        self._advance(section)
+
+    def resolve(self, aweme_id, failed=False):
+        """An issued id was stored, or failed and should be retried on the next run"""
+        seconds, _, section = decode_aweme_id(aweme_id)
+        gaps = self.gaps.setdefault(section, set())
+        if aweme_id in gaps:
+            if not failed:
+                gaps.discard(aweme_id)
+            return
+        if failed:
+            gaps.add(aweme_id)
+        key = (section, seconds)
+        if key in self._pending:
+            self._pending[key] -= 1
+            if self._pending[key] <= 0:
+                del self._pending[key]
+            self._advance(section)
+
+    def abandon(self, aweme_id):
+        """Stop re-issuing a failed id, e.g. once it is dead-lettered"""
+        _, _, section = decode_aweme_id(aweme_id)
+        self.gaps.get(section, set()).discard(aweme_id)
+
+    def _advance(self, section):
+        if section not in self._issued:
+            return
+        pending = [seconds for pending_section, seconds in self._pending if pending_section == section]
+        completed = min(pending) - 1 if pending else self._issued[section]
+        completed = min(completed, self._issued[section])
+        if completed > self.completed.get(section, completed - 1):
+            self.completed[section] = completed
+
+    def walk(self, index, section, start, end=None, milliseconds=1000):
+        """Yield ids to probe for section: earlier failures first, then unprobed ids from the frontier on"""
+        gaps = self.gaps.get(section, set())
+        for aweme_id in sorted(gaps):
+            if aweme_id in index:
+                gaps.discard(aweme_id)
+            else:
+                yield aweme_id
+
+        seconds = self.resume_second(section, start)
+        while end is None or seconds < end:
+            for millisecond in index.unprobed_milliseconds(seconds, section):
+                if millisecond >= milliseconds:
+                    break
+                aweme_id = encode_aweme_id(seconds, millisecond, section)
+                self.issue(aweme_id)
+                yield aweme_id
+            self.close_second(section, seconds)
+            seconds += 1
+
+    def save(self):
+        state = {'sections': {
+            str(section): {
+                'completed': self.completed.get(section),
+                'gaps': sorted(self.gaps.get(section, ())),
+            }
+            for section in set(self.completed) | set(self.gaps)
+        }}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import time
+
+import polars as pl
+
+from corpus import CorpusWriter
+from part_store import PartStore
+from probe_index import ProbeIndex
+
+EDGE_SCHEMA = {
+    'source': pl.UInt64,
+    'target': pl.UInt64,
+    'rank': pl.UInt16,
+    'depth': pl.UInt8,
+    'fetched_at': pl.Float64,
+}
+
+
+class RelatedGraphCrawler:
+    """Breadth-first crawl of the related-videos graph with a resumable frontier.
+
+    Nodes are fetched by concurrent workers sharing one DouyinWebCrawler. Every response adds its
+    videos to the corpus and its (source -> related aweme_id) edges to a columnar edge store;
+    the first `fan_out` related videos of a node are expanded until `max_depth`. Nodes whose
+    videos the corpus writer has stored go to a persistent visited index and the nodes still
+    pending are checkpointed with every flush, so an interrupted crawl resumes instead of
+    starting over from the seeds and never skips a node whose videos were not written.
+    """
+    def __init__(self, crawler, corpus, path='./data/related_graph', max_depth=2, fan_out=10, num_workers=8, batch_size=256):
+        self.crawler = crawler
+        self.corpus = corpus
+        self.corpus_writer = None
+        self.max_depth = max_depth
+        self.fan_out = fan_out
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.edges = PartStore(os.path.join(path, 'edges'), auto_compact=True)
+        self.visited = ProbeIndex(os.path.join(path, 'visited'))
+        self.frontier_path = os.path.join(path, 'frontier.parquet')
+        self.queue = asyncio.Queue()
+        self.pending = {}
+        self.edge_buffer = []
+        self.done_buffer = []
+
+    def load_frontier(self):
+        if not os.path.exists(self.frontier_path):
+            return 0
+        frontier_df = pl.read_parquet(self.frontier_path).sort('depth')
+        for aweme_id, depth in frontier_df.iter_rows():
+            self.enqueue(aweme_id, depth)
+        return frontier_df.height
+
+    def save_frontier(self):
+        tmp_path = self.frontier_path + '.tmp'
+        pl.DataFrame(
+            {'aweme_id': list(self.pending), 'depth': list(self.pending.values())},
+            schema={'aweme_id': pl.String, 'depth': pl.UInt8}
+        ).write_parquet(tmp_path)
+        os.replace(tmp_path, self.frontier_path)
+
+    def enqueue(self, aweme_id, depth):
+        if aweme_id in self.pending or aweme_id in self.visited:
+            return
+        self.pending[aweme_id] = depth
+        self.queue.put_nowait((aweme_id, depth))
+
+    def flush(self):
+        if self.edge_buffer:
+            self.edges.append(pl.DataFrame(self.edge_buffer, schema=EDGE_SCHEMA, orient='row'))
+            self.edge_buffer = []
+        if self.done_buffer:
+            self.visited.add(self.done_buffer)
+            for aweme_id in self.done_buffer:
+                self.pending.pop(aweme_id, None)
+            self.done_buffer = []
+        self.save_frontier()
+
+    async def worker(self, worker_id, pbar=None):
+        while True:
+            aweme_id, depth = await self.queue.get()
+            try:
+                response = await self.crawler.fetch_related_videos(aweme_id)
+                aweme_list = response.get('aweme_list') or []
+                await self.corpus_writer.upsert(aweme_list, source=aweme_id)
+
+                fetched_at = time.time()
+                related_ids = [item['aweme_id'] for item in aweme_list if item.get('aweme_id')]
+                self.edge_buffer.extend(
+                    (int(aweme_id), int(related_id), rank, depth, fetched_at)
+                    for rank, related_id in enumerate(related_ids)
+                )
+                if depth < self.max_depth:
+                    for related_id in related_ids[:self.fan_out]:
+                        self.enqueue(related_id, depth + 1)
+            except Exception as e:
+                # stays in the pending frontier, so the next run retries it
+                print(f"Worker {worker_id} - Error fetching related videos for {aweme_id}: {e}")
+            finally:
+                self.queue.task_done()
+                if pbar is not None:
+                    pbar.update(1)
+                    pbar.set_postfix(frontier=len(self.pending), refresh=False)
+
+    def written(self, aweme_ids):
+        """Nodes whose videos the corpus writer has stored, only these may be marked visited"""
+        self.done_buffer.extend(aweme_ids)
+        if len(self.done_buffer) >= self.batch_size:
+            self.flush()
+
+    async def run(self, seeds, pbar=None):
+        """Crawl from the saved frontier if there is one, otherwise from seeds"""
+        if self.load_frontier() == 0:
+            for aweme_id in seeds:
+                self.enqueue(aweme_id, 0)
+
+        self.corpus_writer = CorpusWriter(self.corpus, batch_size=self.batch_size, on_written=self.written).start()
+        workers = [asyncio.create_task(self.worker(i, pbar)) for i in range(self.num_workers)]
+        try:
+            await self.queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self.corpus_writer.close()
+            self.flush()
+            self.visited.checkpoint()
@@ -1,98 +1,99 @@
+import argparse
 import asyncio
 import datetime
-import os
-from urllib.parse import urlencode
 
-import polars as pl
-import requests
 from tqdm import tqdm
 
-from douyin_scraper.douyin.web.web_crawler import DouyinWebCrawler
-from douyin_scraper.base_crawler import BaseCrawler
-from douyin_scraper.douyin.web.endpoints import DouyinAPIEndpoints
-from douyin_scraper.douyin.web.models import PostDetail
-from douyin_scraper.douyin.web.utils import BogusManager
+from corpus import VideoCorpus
+from density import DensityScheduler, build_prior
+from fetch_engine import PostDetailEngine
+from frontier import Frontier
+from metrics import Metrics
+from part_store import PartStore
+from proxy_pool import PROXIES_PATH, load_proxies
+from probe_index import ProbeOutcomes, load_probe_index
+from raw_segments import SegmentWriter, flatten_response
+from retries import DeadLetters, RetryScheduler
+
 
 async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--start', type=datetime.datetime.fromisoformat, default=datetime.datetime(2025, 6, 1, 10, 0, 0),
+                        help="start of the id window, a saved frontier past it takes precedence")
+    parser.add_argument('--end', type=datetime.datetime.fromisoformat, default=None,
+                        help="stop once the window up to this time has been probed")
+    parser.add_argument('--schedule', choices=['sequential', 'density'], default='sequential',
+                        help="probe every millisecond in order, or the densest regions of the known ids first")
+    parser.add_argument('--sections', type=int, default=16, help="number of sections the density schedule covers")
+    parser.add_argument('--max-attempts', type=int, default=5, help="attempts per id before it is dead-lettered")
+    parser.add_argument('--replay-dead-letters', action='store_true', help="probe only the dead-lettered ids, then stop")
+    parser.add_argument('--proxies', default=PROXIES_PATH, help="file with one proxy url per line to spread requests over")
+    parser.add_argument('--metrics-port', type=int, default=None, help="serve prometheus metrics on this port")
+    parser.add_argument('--metrics-log', default='./data/douyin_sampled_videos_metrics.jsonl',
+                        help="file the metrics are appended to as json lines")
+    parser.add_argument('--metrics-interval', type=float, default=30.0, help="seconds between metrics snapshots")
+    args = parser.parse_args()
+
+    metrics = Metrics()
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+
     sampled_path = './data/douyin_sampled_videos.parquet.zstd'
-    if os.path.exists(sampled_path):
-        sampled_df = pl.read_parquet(sampled_path)
+    store = PartStore('./data/douyin_sampled_videos')
+    store.import_file(sampled_path)
+    index = load_probe_index('./data/douyin_sampled_videos_index', store)
+    # most probed ids do not exist, those are kept as status bits rather than rows
+    outcomes = ProbeOutcomes('./data/douyin_sampled_videos_outcomes')
+    # new responses are captured raw, project_segments.py turns them into typed tables
+    segments = SegmentWriter('./data/douyin_sampled_videos_raw')
+
+    frontier = Frontier('./data/douyin_sampled_videos_frontier.json')
+    # failed ids are retried with backoff, the ones that keep failing are set aside for a replay
+    dead_letters = DeadLetters('./data/douyin_sampled_videos_dead_letters')
+    retries = RetryScheduler(dead_letters, max_attempts=args.max_attempts)
+    start = int(args.start.timestamp())
+    end = int(args.end.timestamp()) if args.end else None
+
+    scheduler = None
+    on_response = None
+    on_abandon = None
+    if args.replay_dead_letters:
+        aweme_ids = dead_letters.ids(index)
+        print(f"Replaying {len(aweme_ids)} dead-lettered ids.")
+    elif args.schedule == 'density':
+        hours, milliseconds, sections = build_prior(VideoCorpus().catalog, n_sections=args.sections)
+        scheduler = DensityScheduler(
+            hours, milliseconds, sections,
+            start, end or int(datetime.datetime.now().timestamp()),
+            stats_path='./data/douyin_sampled_videos_density.parquet'
+        )
+        aweme_ids = scheduler.ids(index)
+        on_response = lambda aweme_id, response: scheduler.record(aweme_id, bool(response.get('aweme_detail')))
+        on_abandon = scheduler.release
     else:
-        sampled_df = pl.DataFrame({'aweme_id': [], 'result': []})
-
-    video_df = pl.read_parquet('./data/douyin_related_videos.parquet.zstd', columns=['aweme_id'])
-    video_df = video_df.with_columns([
-        pl.col('aweme_id').cast(pl.UInt64).map_elements(lambda i: format(i, '064b'), pl.String).alias('aweme_id_bits')
-    ]).with_columns([
-        pl.from_epoch(pl.col('aweme_id_bits').str.slice(0, 32).map_elements(lambda x: int(x, 2), pl.Int64)).alias('timestamp'),
-        pl.col('aweme_id_bits').str.slice(32, 10).map_elements(lambda x: int(x, 2), pl.Int64).alias('millisecond'),
-        pl.col('aweme_id_bits').str.slice(42, 22).alias('section_bits')
-    ])
-    section_df = video_df.group_by(pl.col('section_bits'))\
-        .agg(pl.count().alias('count'))\
-        .sort('count', descending=True)
-    sections = section_df.head(1)['section_bits'].to_list()
-
-    crawler = DouyinWebCrawler()
-
-    # result = await crawler.fetch_one_video(video_df['aweme_id'].to_list()[0])
-
-    start_time = datetime.datetime(2025, 6, 1, 10, 0, 0)
-    current_time = start_time
-    milliseconds = 0
-
-    kwargs = await crawler.get_douyin_headers()
-    # 创建一个基础爬虫
-    base_crawler = BaseCrawler(proxies=kwargs["proxies"], crawler_headers=kwargs["headers"])
-    # 生成一个作品详情的带有a_bogus加密参数的Endpoint
-    # 创建一个作品详情的BaseModel参数
-    params = PostDetail(aweme_id='')
-    params_dict = params.dict()
-    params_dict["msToken"] = ''
-    a_bogus = BogusManager.ab_model_2_endpoint(params_dict, kwargs["headers"]["User-Agent"])
+        sections = VideoCorpus().catalog.most_common(n=1)
+        aweme_ids = frontier.walk(index, sections[0], start, end)
 
     pbar = tqdm()
-    all_results = []
-    while True:
-        if milliseconds >= 1000:
-            milliseconds = 0
-            current_time += datetime.timedelta(seconds=1)
-        timestamp_bits = format(int(current_time.timestamp()), '032b')
-        milliseconds_bits = format(milliseconds, '010b')
-        all_bits = timestamp_bits + milliseconds_bits + sections[0]
-        aweme_id = str(int(all_bits, 2))
-
-        if aweme_id in sampled_df['aweme_id'].to_list():
-            milliseconds += 1
-            continue
-
-        pbar.update(1)
-
-        try:
-            async with base_crawler as crawler:
-                # 生成一个作品详情的带有加密参数的Endpoint
-                # 2024年6月12日22:41:44 由于XBogus加密已经失效，所以不再使用XBogus加密参数，转移至a_bogus加密参数。
-                # endpoint = BogusManager.xb_model_2_endpoint(
-                #     DouyinAPIEndpoints.POST_DETAIL, params.dict(), kwargs["headers"]["User-Agent"]
-                # )
-                params_dict['aweme_id'] = aweme_id
-                endpoint = f"{DouyinAPIEndpoints.POST_DETAIL}?{urlencode(params_dict)}&a_bogus={a_bogus}"
-
-                response = await crawler.fetch_get_json(endpoint)
-                all_results.append({
-                    'aweme_id': aweme_id,
-                    'result': response
-                })
-        except Exception as e:
-            print(f"Error fetching data for video ID {aweme_id}: {e}")
-
-        if len(all_results) > 10:
-            sampled_df = pl.concat([sampled_df, pl.from_dicts(all_results)], how='diagonal_relaxed')
-            all_results = []
-            sampled_df.write_parquet(sampled_path, compression='zstd')
-            sampled_df.write_parquet(sampled_path.replace('videos', 'videos_bckup'), compression='zstd')
-
-        milliseconds += 1
+    snapshots = asyncio.create_task(metrics.write_snapshots(args.metrics_log, args.metrics_interval))
+    try:
+        async with PostDetailEngine(concurrency=16, batch_size=256, proxies=load_proxies(args.proxies), metrics=metrics) as engine:
+            await engine.run(aweme_ids, segments, index=index, frontier=frontier, on_response=on_response, pbar=pbar,
+                             metrics=metrics, outcomes=outcomes, flatten=flatten_response, retries=retries,
+                             on_abandon=on_abandon)
+    finally:
+        snapshots.cancel()
+        await asyncio.gather(snapshots, return_exceptions=True)
+        metrics.close()
+        segments.close()
+        dead_letters.close()
+        index.checkpoint()
+        outcomes.checkpoint()
+        frontier.save()
+        pbar.close()
+        if scheduler is not None:
+            scheduler.save()
+            print(scheduler.report().head(20))
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
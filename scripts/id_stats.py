@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import polars as pl
+
+from aweme_ids import MILLISECOND_BITS, MILLISECOND_MASK, MILLISECOND_SHIFT, SECTION_BITS, SECTION_MASK, TIMESTAMP_SHIFT
+from part_store import PartStore
+
+HISTOGRAMS = {
+    'hour': 24,
+    'minute': 60,
+    'second': 60,
+    'millisecond': 1 << MILLISECOND_BITS,
+    'section': 1 << SECTION_BITS,
+}
+
+
+def empty_histograms():
+    return {name: np.zeros(size, dtype=np.int64) for name, size in HISTOGRAMS.items()}
+
+
+def add_ids(histograms, ids):
+    """Count a uint64 array of aweme_ids into the fixed-size histograms"""
+    seconds = ids >> np.uint64(TIMESTAMP_SHIFT)
+    parts = {
+        'hour': (seconds // np.uint64(3600)) % np.uint64(24),
+        'minute': (seconds // np.uint64(60)) % np.uint64(60),
+        'second': seconds % np.uint64(60),
+        'millisecond': (ids >> np.uint64(MILLISECOND_SHIFT)) & np.uint64(MILLISECOND_MASK),
+        'section': ids & np.uint64(SECTION_MASK),
+    }
+    for name, values in parts.items():
+        histograms[name] += np.bincount(values.astype(np.intp), minlength=HISTOGRAMS[name])
+
+
+def file_histograms(path, chunk_rows=1_000_000):
+    """All histograms of one parquet file in a single pass over its aweme_id column, chunk by chunk"""
+    histograms = empty_histograms()
+    scan = pl.scan_parquet(path).select(pl.col('aweme_id').cast(pl.UInt64))
+    rows = scan.select(pl.len()).collect().item()
+    for offset in range(0, rows, chunk_rows):
+        ids = scan.slice(offset, chunk_rows).collect()['aweme_id'].drop_nulls().to_numpy()
+        add_ids(histograms, ids)
+    return histograms
+
+
+def dataset_files(paths):
+    """Expand parquet files and PartStore directories into the list of parquet files to read"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(PartStore(path).parts())
+        elif os.path.exists(path):
+            files.append(path)
+        else:
+            print(f"Skipping {path}, no such file or directory")
+    return files
+
+
+class HistogramCache:
+    """Per-file partial histograms on disk, keyed by path, size and mtime.
+
+    Files that did not change since the last run are not read again; entries of files that
+    disappeared, e.g. parts merged by compaction, or changed since are evicted.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index_path = os.path.join(path, 'index.json')
+        os.makedirs(path, exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+
+    @staticmethod
+    def _key(file_path):
+        stat = os.stat(file_path)
+        return f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npz')
+
+    def _save(self, key, histograms):
+        section = histograms['section']
+        nonzero = np.flatnonzero(section)
+        np.savez_compressed(
+            self._entry_path(key),
+            **{name: values for name, values in histograms.items() if name != 'section'},
+            section_index=nonzero,
+            section_count=section[nonzero],
+        )
+
+    def _load(self, key):
+        with np.load(self._entry_path(key)) as data:
+            histograms = {name: data[name] for name in HISTOGRAMS if name != 'section'}
+            section = np.zeros(HISTOGRAMS['section'], dtype=np.int64)
+            section[data['section_index']] = data['section_count']
+            histograms['section'] = section
+        return histograms
+
+    def _is_current(self, key, file_path):
+        return os.path.exists(file_path) and self._key(file_path) == key
+
+    def histograms(self, files):
+        """Merged histograms over files, reading only those not cached yet"""
+        merged = empty_histograms()
+        for file_path in files:
+            key = self._key(file_path)
+            if key in self.index:
+                partial = self._load(key)
+            else:
+                partial = file_histograms(file_path)
+                self._save(key, partial)
+                self.index[key] = os.path.abspath(file_path)
+            for name in merged:
+                merged[name] += partial[name]
+
+        # entries of other files stay, e.g. another dataset sharing the cache, only ones whose
+        # file is gone or was rewritten since can never be hit again
+        for stale_key in [key for key, file_path in self.index.items() if not self._is_current(key, file_path)]:
+            if os.path.exists(self._entry_path(stale_key)):
+                os.remove(self._entry_path(stale_key))
+            del self.index[stale_key]
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+        return merged
+
+
+def histogram_frame(counts, name):
+    return pl.DataFrame({name: np.arange(len(counts)), 'count': counts})
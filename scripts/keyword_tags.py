@@ -0,0 +1,78 @@
+import hashlib
+import re
+import json
+import os
+
+import polars as pl
+
+from part_store import PartStore
+
+TAGS_PATH = './data/douyin_related_videos_tags'
+
+
+def parse_keywords(text):
+    """Keywords from lines like 'word or other word (explanation)'"""
+    all_keywords = []
+    for line in text.splitlines():
+        if '(' not in line:
+            continue
+        keywords, explanation = line.split('(', 1)
+        # 'or' only as a separate word, never inside a keyword like 'color'
+        keywords = re.split(r'\s+or\s+', keywords)
+        keywords = [k.strip() for k in keywords]
+        all_keywords.extend(k for k in keywords if k and k not in all_keywords)
+    return all_keywords
+
+
+class KeywordTagger:
+    """Per-video matched keyword ids, stored next to the corpus and versioned by the hash of its keywords.
+
+    Tags for a given keyword list live in their own store, so editing keywords.txt starts a new
+    tag table and the next sync tags the corpus once against it; otherwise only videos that have
+    no tags yet are tagged.
+    """
+    def __init__(self, keywords_path='./data/keywords.txt', path=TAGS_PATH):
+        with open(keywords_path, 'r') as f:
+            text = f.read()
+        self.keywords = parse_keywords(text)
+        # hashed after parsing, so tags from a different reading of the same file are not reused
+        self.hash = hashlib.sha256(json.dumps(self.keywords, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+        self.store = PartStore(os.path.join(path, self.hash), auto_compact=True)
+        keywords_json = os.path.join(self.store.path, 'keywords.json')
+        if not os.path.exists(keywords_json):
+            with open(keywords_json, 'w') as f:
+                json.dump(self.keywords, f, ensure_ascii=False)
+
+    def tag(self, aweme_ids, descs):
+        df = pl.DataFrame({'aweme_id': aweme_ids, 'desc': descs}, schema={'aweme_id': pl.String, 'desc': pl.String})
+        if not self.keywords:
+            return df.select('aweme_id', pl.lit([], dtype=pl.List(pl.UInt16)).alias('keyword_ids'))
+        # one Aho-Corasick pass per desc, overlapping so keywords inside longer ones are found too
+        keyword_ids = pl.col('desc').str.extract_many(self.keywords, overlapping=True)\
+            .list.eval(pl.element().replace_strict(self.keywords, range(len(self.keywords)), return_dtype=pl.UInt16))\
+            .list.unique()\
+            .list.sort()\
+            .fill_null(pl.lit([], dtype=pl.List(pl.UInt16)))
+        return df.select('aweme_id', keyword_ids.alias('keyword_ids'))
+
+    def tag_records(self, items):
+        """Tag freshly ingested videos"""
+        if not items:
+            return
+        self.store.append(self.tag([item['aweme_id'] for item in items], [item.get('desc') for item in items]))
+
+    def sync(self, corpus):
+        """Tag every corpus video without tags for the current keyword file, returns how many"""
+        missing = corpus.scan(columns=['aweme_id', 'desc'])
+        tagged = self.store.scan(columns=['aweme_id'])
+        if self.store.parts():
+            missing = missing.join(tagged, on='aweme_id', how='anti')
+        missing = missing.unique(subset=['aweme_id']).collect()
+        if missing.height:
+            self.store.append(self.tag(missing['aweme_id'].to_list(), missing['desc'].to_list()))
+        return missing.height
+
+    def scan(self):
+        """aweme_id, keyword_ids and a has_keyword flag for every tagged video"""
+        return self.store.scan(columns=['aweme_id', 'keyword_ids'])\
+            .with_columns((pl.col('keyword_ids').list.len() > 0).alias('has_keyword'))
@@ -0,0 +1,189 @@
+import asyncio
+import contextlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# seconds, covers a fast local response up to a request stuck in retries
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}="{value}"' for key, value in sorted(labels.items())) + '}'
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile"""
+        if not self.count:
+            return None
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    """Counters, gauges and latency histograms for one crawl process.
+
+    Updates are cheap and thread safe. The current values are served in the Prometheus text
+    format by serve() and appended as one JSON line per interval by write_snapshots(), so a
+    running crawl shows whether the id generator, the fetch workers or the writer is behind.
+    """
+    def __init__(self, prefix='douyin'):
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _name(self, name):
+        return f"{self.prefix}_{name}"
+
+    def inc(self, name, value=1, **labels):
+        key = (self._name(name), tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (self._name(name), tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = _Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    def gauge(self, name, fn, **labels):
+        """Register a callable read every time the metrics are exported, e.g. a queue's qsize"""
+        self.gauges[(self._name(name), tuple(sorted(labels.items())))] = fn
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _gauge_values(self):
+        values = {}
+        for key, fn in list(self.gauges.items()):
+            try:
+                values[key] = float(fn())
+            except Exception:
+                # the object behind a gauge may already be gone at shutdown
+                continue
+        return values
+
+    def render(self):
+        """Current values in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: (list(histogram.cumulative()), histogram.count, histogram.sum)
+                          for key, histogram in self.histograms.items()}
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            declare(name, 'counter')
+            lines.append(f"{_series(name, dict(labels))} {value}")
+        for (name, labels), value in sorted(self._gauge_values().items()):
+            declare(name, 'gauge')
+            lines.append(f"{_series(name, dict(labels))} {value}")
+        for (name, labels), (cumulative, count, total) in sorted(histograms.items()):
+            declare(name, 'histogram')
+            labels = dict(labels)
+            for bound, bucket_count in cumulative:
+                lines.append(f"{_series(name + '_bucket', dict(labels, le=bound))} {bucket_count}")
+            lines.append(f"{_series(name + '_bucket', dict(labels, le='+Inf'))} {count}")
+            lines.append(f"{_series(name + '_count', labels)} {count}")
+            lines.append(f"{_series(name + '_sum', labels)} {total}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Current values as a flat json serializable dict, histograms summarised"""
+        snapshot = {'time': time.time()}
+        with self._lock:
+            for (name, labels), value in self.counters.items():
+                snapshot[_series(name, dict(labels))] = value
+            for (name, labels), histogram in self.histograms.items():
+                series = _series(name, dict(labels))
+                snapshot[series] = {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'p50': histogram.quantile(0.5),
+                    'p99': histogram.quantile(0.99),
+                }
+        for (name, labels), value in self._gauge_values().items():
+            snapshot[_series(name, dict(labels))] = value
+        return snapshot
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve /metrics on a daemon thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+    def write_snapshot(self, path):
+        with open(path, 'a') as f:
+            f.write(json.dumps(self.snapshot()) + '\n')
+
+    async def write_snapshots(self, path, interval=30.0):
+        """Append a snapshot to path every interval seconds until cancelled, and once more at the end"""
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                self.write_snapshot(path)
+        finally:
+            self.write_snapshot(path)
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
@@ -0,0 +1,209 @@
+import collections
+import contextlib
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+
+import polars as pl
+
+
+class PartStore:
+    """Append-only dataset of immutable parquet part files tracked by an atomically replaced manifest.
+
+    Every append writes one new part, so flush cost depends on the batch size rather than on the
+    size of the dataset. Small parts are merged in the background by compact(). Merged parts
+    are retired rather than deleted, and only removed by a compaction at least
+    `retire_seconds` later, so scans planned against the old parts can still be collected.
+    """
+    def __init__(self, path, compression='zstd', auto_compact=False, retire_seconds=3600):
+        self.path = path
+        self.compression = compression
+        self.auto_compact = auto_compact
+        self.retire_seconds = retire_seconds
+        self.manifest_path = os.path.join(path, 'manifest.json')
+        self.lock_path = os.path.join(path, '.lock')
+        self._compact_thread = None
+        os.makedirs(path, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # the manifest is shared between threads and processes writing to the same store
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {'parts': []}
+        with open(self.manifest_path, 'r') as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest):
+        tmp_path = f"{self.manifest_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def _write_part(self, df):
+        name = f"part-{time.time_ns()}-{os.getpid()}-{uuid.uuid4().hex[:8]}.parquet"
+        part_path = os.path.join(self.path, name)
+        tmp_path = part_path + '.tmp'
+        df.write_parquet(tmp_path, compression=self.compression)
+        os.replace(tmp_path, part_path)
+        return {'name': name, 'rows': df.height, 'bytes': os.path.getsize(part_path)}
+
+    def parts(self):
+        return [os.path.join(self.path, part['name']) for part in self._read_manifest()['parts']]
+
+    def __len__(self):
+        return sum(part['rows'] for part in self._read_manifest()['parts'])
+
+    def append(self, df):
+        """Write df as a new part and commit it to the manifest, returns the part entry"""
+        if df.height == 0:
+            return None
+        part = self._write_part(df)
+        with self._locked():
+            manifest = self._read_manifest()
+            manifest['parts'].append(part)
+            self._write_manifest(manifest)
+        if self.auto_compact:
+            self.compact_in_background()
+        return part
+
+    def append_records(self, records):
+        """Append a list of row dicts, inferring the schema from all of them"""
+        if not records:
+            return None
+        return self.append(pl.from_dicts(records, infer_schema_length=len(records), strict=False))
+
+    def scan(self, columns=None):
+        """Lazily scan all committed parts as one dataset"""
+        parts = self.parts()
+        if not parts:
+            return pl.LazyFrame()
+        frames = [pl.scan_parquet(part) for part in parts]
+        if columns is not None:
+            frames = [frame.select(columns) for frame in frames]
+        return pl.concat(frames, how='diagonal_relaxed')
+
+    def read(self, columns=None):
+        return self.scan(columns).collect()
+
+    def import_file(self, path):
+        """Seed an empty store with an existing single-file parquet dataset"""
+        if len(self.parts()) == 0 and os.path.exists(path):
+            self.append(pl.read_parquet(path))
+
+    @staticmethod
+    def _tier(rows, fan_in):
+        # parts within a factor of fan_in of each other share a tier
+        tier = 0
+        while rows >= fan_in:
+            rows //= fan_in
+            tier += 1
+        return tier
+
+    def compact(self, min_parts=8, target_rows=1_000_000):
+        """Merge parts of similar size into larger ones, readers see either the old or the new parts.
+
+        Parts under target_rows are grouped into tiers by their number of rows, and a tier with
+        min_parts parts is merged into one part of the next tier, so a row is rewritten about
+        once per tier on its way to target_rows rather than on every compaction.
+        """
+        self._remove_retired()
+        num_merged = 0
+        while True:
+            tiers = collections.defaultdict(list)
+            for part in self._read_manifest()['parts']:
+                if part['rows'] < target_rows:
+                    tiers[self._tier(part['rows'], min_parts)].append(part)
+            full_tiers = [tier for tier, parts in tiers.items() if len(parts) >= min_parts]
+            if not full_tiers:
+                return num_merged
+            merged = self._merge(tiers[min(full_tiers)])
+            if not merged:
+                return num_merged
+            num_merged += merged
+
+    def _merge(self, parts):
+        df = pl.concat(
+            [pl.scan_parquet(os.path.join(self.path, part['name'])) for part in parts],
+            how='diagonal_relaxed'
+        ).collect()
+        return self._replace(parts, df)
+
+    def _replace(self, parts, df):
+        """Swap parts for one new part holding df, returns how many were replaced"""
+        new_part = self._write_part(df)
+
+        replaced_names = {part['name'] for part in parts}
+        with self._locked():
+            manifest = self._read_manifest()
+            current_names = [part['name'] for part in manifest['parts']]
+            if not replaced_names <= set(current_names):
+                # another compaction got there first
+                os.remove(os.path.join(self.path, new_part['name']))
+                return 0
+            # parts may have been appended since we read the manifest, keep them
+            position = min(current_names.index(name) for name in replaced_names)
+            kept = [part for part in manifest['parts'] if part['name'] not in replaced_names]
+            manifest['parts'] = kept[:position] + [new_part] + kept[position:]
+            # lazy scans may still read the replaced files, they are removed once retire_seconds have passed
+            retired_at = time.time()
+            manifest['retired'] = manifest.get('retired', []) + [
+                {'name': name, 'retired_at': retired_at} for name in sorted(replaced_names)
+            ]
+            self._write_manifest(manifest)
+        return len(parts)
+
+    def _remove_retired(self):
+        """Delete the files of parts retired more than retire_seconds ago"""
+        cutoff = time.time() - self.retire_seconds
+        with self._locked():
+            manifest = self._read_manifest()
+            expired = [part for part in manifest.get('retired', []) if part['retired_at'] <= cutoff]
+            if not expired:
+                return
+            manifest['retired'] = [part for part in manifest['retired'] if part['retired_at'] > cutoff]
+            self._write_manifest(manifest)
+        for part in expired:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.path, part['name']))
+
+    def rewrite(self, transform, predicate):
+        """Replace every part whose schema satisfies predicate by transform applied to its rows, returns how many"""
+        num_rewritten = 0
+        for part in self._read_manifest()['parts']:
+            part_path = os.path.join(self.path, part['name'])
+            if predicate(pl.read_parquet_schema(part_path)):
+                num_rewritten += self._replace([part], transform(pl.read_parquet(part_path)))
+        return num_rewritten
+
+    def compact_in_background(self, **kwargs):
+        """Start compact() on a daemon thread unless a compaction is already running"""
+        if self._compact_thread is not None and self._compact_thread.is_alive():
+            return self._compact_thread
+        self._compact_thread = threading.Thread(target=self.compact, kwargs=kwargs, daemon=True)
+        self._compact_thread.start()
+        return self._compact_thread
+
+    def wait_for_compaction(self):
+        if self._compact_thread is not None:
+            self._compact_thread.join()
+
+
+def scan_dataset(path, columns=None):
+    """Lazily scan either a single parquet file or a PartStore directory"""
+    if os.path.isdir(path):
+        return PartStore(path).scan(columns)
+    scan = pl.scan_parquet(path)
+    return scan if columns is None else scan.select(columns)
@@ -0,0 +1,249 @@
+import json
+import os
+
+import numpy as np
+import polars as pl
+
+from aweme_ids import MILLISECOND_BITS, MILLISECOND_MASK, MILLISECOND_SHIFT, SECTION_BITS, SECTION_MASK, TIMESTAMP_SHIFT
+
+BITMAP_BYTES = (1 << MILLISECOND_BITS) // 8
+MILLISECONDS = 1000
+
+
+def _as_id_array(aweme_ids):
+    if isinstance(aweme_ids, np.ndarray):
+        return aweme_ids.astype(np.uint64, copy=False)
+    return np.fromiter((int(i) for i in aweme_ids), dtype=np.uint64)
+
+
+def split_ids(aweme_ids):
+    """Split aweme_ids into (second, section) keys and millisecond slots"""
+    ids = _as_id_array(aweme_ids)
+    seconds = ids >> np.uint64(TIMESTAMP_SHIFT)
+    sections = ids & np.uint64(SECTION_MASK)
+    milliseconds = (ids >> np.uint64(MILLISECOND_SHIFT)) & np.uint64(MILLISECOND_MASK)
+    return (seconds << np.uint64(SECTION_BITS)) | sections, milliseconds
+
+
+def index_key(seconds, section):
+    return (seconds << SECTION_BITS) | section
+
+
+class ProbeIndex:
+    """Persistent index of probed aweme_ids, one millisecond bitmap per (second, section).
+
+    The consolidated index is a sorted uint64 key array with a matching (n, 128) uint8 bitmap
+    array, both memory-mapped at startup. Probes added since the last checkpoint live in an
+    in-memory delta and are appended to a journal of raw ids so they survive a crash.
+    """
+    def __init__(self, path, checkpoint_every=1_000_000):
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.current_path = os.path.join(path, 'current.json')
+        self.journal_path = os.path.join(path, 'journal.bin')
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        self.generation = 0
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.bitmaps = np.empty((0, BITMAP_BYTES), dtype=np.uint8)
+        if os.path.exists(self.current_path):
+            with open(self.current_path, 'r') as f:
+                self.generation = json.load(f)['generation']
+            self.keys = np.load(self._generation_path('keys'), mmap_mode='r')
+            self.bitmaps = np.load(self._generation_path('bitmaps'), mmap_mode='r')
+
+        self.delta = {}
+        self.journal_size = 0
+        if os.path.exists(self.journal_path):
+            ids = np.fromfile(self.journal_path, dtype='<u8')
+            self._apply(ids)
+            self.journal_size = len(ids)
+
+    def _generation_path(self, kind, generation=None):
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.path, f"{kind}-{generation:06d}.npy")
+
+    def _base_row(self, key):
+        i = np.searchsorted(self.keys, np.uint64(key))
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.bitmaps[i]
+        return None
+
+    def _row(self, key):
+        row = self.delta.get(key)
+        if row is not None:
+            return row
+        return self._base_row(key)
+
+    def _apply(self, ids):
+        keys, milliseconds = split_ids(ids)
+        for key, ms in zip(keys.tolist(), milliseconds.tolist()):
+            row = self.delta.get(key)
+            if row is None:
+                base = self._base_row(key)
+                row = bytearray(base.tobytes()) if base is not None else bytearray(BITMAP_BYTES)
+                self.delta[key] = row
+            row[ms >> 3] |= 1 << (ms & 7)
+
+    def __contains__(self, aweme_id):
+        key, ms = split_ids([aweme_id])
+        row = self._row(int(key[0]))
+        ms = int(ms[0])
+        return row is not None and bool(row[ms >> 3] & (1 << (ms & 7)))
+
+    def add(self, aweme_ids):
+        """Record probed ids, durable once this returns"""
+        ids = _as_id_array(aweme_ids)
+        if len(ids) == 0:
+            return
+        with open(self.journal_path, 'ab') as f:
+            ids.astype('<u8').tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        self._apply(ids)
+        self.journal_size += len(ids)
+        if self.journal_size >= self.checkpoint_every:
+            self.checkpoint()
+
+    def probed_milliseconds(self, seconds, section):
+        """Boolean array of the 1000 millisecond slots of this second, True where probed"""
+        row = self._row(index_key(seconds, section))
+        if row is None:
+            return np.zeros(MILLISECONDS, dtype=bool)
+        bits = np.unpackbits(np.frombuffer(bytes(row), dtype=np.uint8), bitorder='little')
+        return bits[:MILLISECONDS].astype(bool)
+
+    def unprobed_milliseconds(self, seconds, section):
+        """Millisecond slots of this second that have not been probed yet, in order"""
+        return np.flatnonzero(~self.probed_milliseconds(seconds, section)).tolist()
+
+    def probed_count(self):
+        total = int(np.unpackbits(np.asarray(self.bitmaps)).sum()) if len(self.keys) else 0
+        for key, row in self.delta.items():
+            base = self._base_row(key)
+            if base is not None:
+                total -= int(np.unpackbits(base).sum())
+            total += int(np.unpackbits(np.frombuffer(bytes(row), dtype=np.uint8)).sum())
+        return total
+
+    def checkpoint(self):
+        """Fold the delta into a new memory-mapped generation and truncate the journal"""
+        if not self.delta:
+            return
+        delta_keys = np.fromiter(sorted(self.delta), dtype=np.uint64, count=len(self.delta))
+        delta_rows = np.frombuffer(
+            b''.join(bytes(self.delta[int(key)]) for key in delta_keys), dtype=np.uint8
+        ).reshape(-1, BITMAP_BYTES)
+        # delta rows already include the bits of their base row
+        keep = ~np.isin(self.keys, delta_keys)
+        keys = np.concatenate([self.keys[keep], delta_keys])
+        bitmaps = np.concatenate([self.bitmaps[keep], delta_rows])
+        order = np.argsort(keys, kind='stable')
+        self._write_generation(keys[order], bitmaps[order])
+
+    def _write_generation(self, keys, bitmaps):
+        generation = self.generation + 1
+        for kind, array in (('keys', keys), ('bitmaps', bitmaps)):
+            tmp_path = self._generation_path(kind, generation) + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, self._generation_path(kind, generation))
+
+        tmp_path = self.current_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'generation': generation}, f)
+        os.replace(tmp_path, self.current_path)
+        # replaying a journal that is already folded in is harmless, so truncating last is safe
+        open(self.journal_path, 'wb').close()
+
+        old_generation = self.generation
+        self.generation = generation
+        self.keys = np.load(self._generation_path('keys'), mmap_mode='r')
+        self.bitmaps = np.load(self._generation_path('bitmaps'), mmap_mode='r')
+        self.delta = {}
+        self.journal_size = 0
+        if old_generation:
+            for kind in ('keys', 'bitmaps'):
+                os.remove(self._generation_path(kind, old_generation))
+
+    def build(self, aweme_ids):
+        """Bulk load ids, e.g. from an existing results dataset, straight into a new generation"""
+        self.checkpoint()
+        keys, milliseconds = split_ids(aweme_ids)
+        keys = np.concatenate([self.keys, keys])
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        bitmaps = np.zeros((len(unique_keys), BITMAP_BYTES), dtype=np.uint8)
+        if len(self.keys):
+            bitmaps[inverse[:len(self.keys)]] = self.bitmaps
+        new_rows = inverse[len(self.keys):]
+        np.bitwise_or.at(
+            bitmaps,
+            (new_rows, (milliseconds >> np.uint64(3)).astype(np.intp)),
+            (np.uint8(1) << (milliseconds & np.uint64(7)).astype(np.uint8)),
+        )
+        self._write_generation(unique_keys, bitmaps)
+
+    def is_empty(self):
+        return len(self.keys) == 0 and not self.delta
+
+
+def load_probe_index(path, store=None):
+    """Open the index at path, seeding it from the ids in a results store the first time"""
+    index = ProbeIndex(path)
+    if index.is_empty() and store is not None and store.parts():
+        ids = store.scan(columns=['aweme_id'])\
+            .select(pl.col('aweme_id').cast(pl.UInt64))\
+            .collect()['aweme_id'].to_numpy()
+        index.build(ids)
+    return index
+
+
+# earlier statuses take precedence, an id that errored once and was fetched later counts as fetched
+STATUSES = ('hit', 'miss', 'empty', 'error')
+
+
+class ProbeOutcomes:
+    """Status code of every probe, kept as one millisecond bitmap index per status.
+
+    Only hits are worth their payload; a miss, an empty (throttled) response or an error is a
+    single bit in the bitmap of its status, so the space and load time of the outcomes grow
+    with the (second, section) pairs probed rather than with the number of probes. Outcomes
+    are buffered by record() and made durable by flush().
+    """
+    def __init__(self, path):
+        self.path = path
+        self.indexes = {status: ProbeIndex(os.path.join(path, status)) for status in STATUSES}
+        self.pending = {status: [] for status in STATUSES}
+
+    def record(self, aweme_id, status):
+        self.pending[status].append(aweme_id)
+
+    def flush(self):
+        for status, ids in self.pending.items():
+            if ids:
+                self.indexes[status].add(ids)
+                self.pending[status] = []
+
+    def status(self, aweme_id):
+        """Status of a probed id, None if it was never probed"""
+        for status in STATUSES:
+            if aweme_id in self.indexes[status]:
+                return status
+        return None
+
+    def status_codes(self, seconds, section):
+        """uint8 array of the 1000 millisecond slots of this second, 0 if unprobed else 1 + STATUSES index"""
+        codes = np.zeros(MILLISECONDS, dtype=np.uint8)
+        for code, status in reversed(list(enumerate(STATUSES, 1))):
+            codes[self.indexes[status].probed_milliseconds(seconds, section)] = code
+        return codes
+
+    def counts(self):
+        return {status: index.probed_count() for status, index in self.indexes.items()}
+
+    def checkpoint(self):
+        self.flush()
+        for index in self.indexes.values():
+            index.checkpoint()
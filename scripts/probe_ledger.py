@@ -0,0 +1,56 @@
+class ProbeLedger:
+    """Bookkeeping of probed ids shared by the crawlers: probe index, outcomes, frontier and retries.
+
+    Every part is optional. failed() runs as soon as a probe fails and written() once a batch of
+    results is on disk, both on the event loop, so a crawler only decides what the status of a
+    probe is and when its batch is written.
+    """
+    def __init__(self, index=None, outcomes=None, frontier=None, retries=None, metrics=None, on_abandon=None):
+        self.index = index
+        self.outcomes = outcomes
+        self.frontier = frontier
+        self.retries = retries
+        self.metrics = metrics
+        self.on_abandon = on_abandon
+
+    def failed(self, aweme_id, status, error=None):
+        """Record a failed probe and schedule its retry, or give the id up when out of attempts"""
+        if self.outcomes is not None:
+            self.outcomes.record(aweme_id, status)
+        if self.frontier is not None:
+            self.frontier.resolve(aweme_id, failed=True)
+        if self.retries is not None and self.retries.failed(aweme_id, error):
+            if self.metrics is not None:
+                self.metrics.inc('retries_total', reason=status)
+            return
+        if self.retries is not None:
+            if self.metrics is not None:
+                self.metrics.inc('dead_letters_total')
+            if self.frontier is not None:
+                self.frontier.abandon(aweme_id)
+        if self.on_abandon is not None:
+            self.on_abandon(aweme_id)
+
+    def succeeded(self, aweme_id):
+        if self.retries is not None:
+            self.retries.succeeded(aweme_id)
+
+    def written(self, statuses):
+        """Mark a written batch of (aweme_id, 'hit' or 'miss') as probed"""
+        resolved = [aweme_id for aweme_id, _ in statuses]
+        if self.index is not None:
+            self.index.add(resolved)
+        if self.outcomes is not None:
+            for aweme_id, status in statuses:
+                self.outcomes.record(aweme_id, status)
+            self.outcomes.flush()
+        # dead letters before the frontier that no longer re-issues them
+        self.flush_dead_letters()
+        if self.frontier is not None:
+            for aweme_id in resolved:
+                self.frontier.resolve(aweme_id)
+            self.frontier.save()
+
+    def flush_dead_letters(self):
+        if self.retries is not None and self.retries.dead_letters is not None:
+            self.retries.dead_letters.flush()
@@ -0,0 +1,18 @@
+import argparse
+
+from raw_segments import PROJECTIONS, project
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Project raw response segments into typed parquet tables")
+    parser.add_argument('segments', help="directory of raw segments, e.g. ./data/douyin_sample_related_videos_raw")
+    parser.add_argument('--projection', choices=sorted(PROJECTIONS), required=True)
+    parser.add_argument('--out', default='./data/projected')
+    args = parser.parse_args()
+
+    df = project(args.segments, PROJECTIONS[args.projection], args.out).collect()
+    print(df)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import asyncio
+import os
+import random
+import time
+from urllib.parse import urlencode, urlparse
+
+import polars as pl
+from douyin_scraper.base_crawler import BaseCrawler
+from douyin_scraper.douyin.web.endpoints import DouyinAPIEndpoints
+from douyin_scraper.douyin.web.models import PostDetail, PostRelated, UserPost
+from douyin_scraper.douyin.web.utils import BogusManager
+from douyin_scraper.douyin.web.web_crawler import DouyinWebCrawler
+
+PROXIES_PATH = './data/proxies.txt'
+
+
+def load_proxies(path=PROXIES_PATH):
+    """Proxy urls from a text file, one per line, blank lines and # comments are skipped"""
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        lines = [line.split('#')[0].strip() for line in f]
+    return [line for line in lines if line]
+
+
+def proxy_label(proxy):
+    """host:port of a proxy url, so credentials never end up in logs or metrics"""
+    url = urlparse(proxy)
+    return f"{url.hostname}:{url.port}" if url.port else url.hostname or proxy
+
+
+class ProxyState:
+    """Health of one proxy and the client whose connections go through it"""
+    def __init__(self, label, proxies, crawler):
+        self.label = label
+        self.proxies = proxies
+        self.crawler = crawler
+        self.requests = 0
+        self.failures = 0
+        self.success_rate = 1.0
+        self.latency = None
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.backoff = 0
+        self.cooldown_until = 0.0
+
+    def score(self):
+        # proxies not tried yet come first, after that fast and reliable ones with spare capacity,
+        # one that was tried but never answered comes last
+        if self.latency is None:
+            return float('inf') if self.requests == 0 and self.in_flight == 0 else 0.0
+        return self.success_rate / ((self.latency + 0.001) * (1 + self.in_flight))
+
+
+class ProxyPool:
+    """Spreads requests over many proxies, each with its own BaseCrawler and so its own connection pool.
+
+    Every request goes to the better of two randomly picked proxies that are not cooling down,
+    judged by their smoothed success rate, latency and requests in flight. A proxy that fails
+    `failures_before_cooldown` times in a row, where an empty (throttled) response counts as a
+    failure, is benched for `cooldown` seconds, doubling up to `max_cooldown` while it keeps
+    failing after each cooldown, as long as another proxy is left. Without configured proxies
+    the pool holds the single proxy setting of get_douyin_headers(), i.e. behaves like the
+    crawlers did before.
+    """
+    def __init__(self, proxies=None, connections_per_proxy=16, cooldown=5.0, max_cooldown=300.0,
+                 failures_before_cooldown=2, smoothing=0.1, metrics=None, seed=None):
+        self.proxy_urls = list(proxies or [])
+        self.connections_per_proxy = connections_per_proxy
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures_before_cooldown = failures_before_cooldown
+        self.smoothing = smoothing
+        self.metrics = metrics
+        self.rng = random.Random(seed)
+        self.headers = None
+        self.states = []
+
+    def _add(self, label, proxies):
+        crawler = BaseCrawler(
+            proxies=proxies,
+            crawler_headers=self.headers,
+            max_connections=self.connections_per_proxy,
+            max_tasks=self.connections_per_proxy,
+        )
+        self.states.append(ProxyState(label, proxies, crawler))
+
+    async def open(self):
+        kwargs = await DouyinWebCrawler().get_douyin_headers()
+        self.headers = kwargs["headers"]
+        if not self.proxy_urls:
+            self._add('default', kwargs["proxies"])
+        for proxy in self.proxy_urls:
+            self._add(proxy_label(proxy), {'http://': proxy, 'https://': proxy})
+        if self.metrics is not None:
+            self.metrics.gauge('proxies_available', self.available)
+
+    async def close(self):
+        for state in self.states:
+            await state.crawler.close()
+        self.states = []
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def available(self):
+        now = time.monotonic()
+        return sum(state.cooldown_until <= now for state in self.states)
+
+    async def acquire(self):
+        """Pick a proxy for one request, waiting if every proxy is cooling down"""
+        while True:
+            now = time.monotonic()
+            candidates = [state for state in self.states if state.cooldown_until <= now]
+            if candidates:
+                break
+            await asyncio.sleep(min(state.cooldown_until for state in self.states) - now)
+        if len(candidates) == 1:
+            state = candidates[0]
+        else:
+            first, second = self.rng.sample(candidates, 2)
+            state = first if first.score() >= second.score() else second
+        state.in_flight += 1
+        return state
+
+    def release(self, state, ok, latency):
+        state.in_flight -= 1
+        state.requests += 1
+        state.success_rate += self.smoothing * (float(ok) - state.success_rate)
+        if ok:
+            state.latency = latency if state.latency is None else state.latency + self.smoothing * (latency - state.latency)
+            state.consecutive_failures = 0
+            state.backoff = max(0, state.backoff - 1)
+        else:
+            state.failures += 1
+            state.consecutive_failures += 1
+            # the last proxy standing is never benched, slowing down is then up to the caller
+            if state.consecutive_failures >= self.failures_before_cooldown and self.available() > 1:
+                cooldown = min(self.max_cooldown, self.cooldown * 2 ** state.backoff)
+                # jittered so benched proxies do not all come back at the same moment
+                state.cooldown_until = time.monotonic() + cooldown * self.rng.uniform(0.5, 1.0)
+                state.backoff += 1
+                state.consecutive_failures = 0
+        if self.metrics is not None:
+            self.metrics.inc('proxy_requests_total', proxy=state.label, outcome='ok' if ok else 'failed')
+
+    async def fetch_get_json(self, endpoint):
+        """BaseCrawler.fetch_get_json through the best available proxy"""
+        state = await self.acquire()
+        started = time.perf_counter()
+        try:
+            response = await state.crawler.fetch_get_json(endpoint)
+        except Exception:
+            self.release(state, False, time.perf_counter() - started)
+            raise
+        self.release(state, bool(response), time.perf_counter() - started)
+        return response
+
+    def report(self):
+        """Requests, failures, success rate, latency and cooldown per proxy"""
+        now = time.monotonic()
+        return pl.DataFrame([{
+            'proxy': state.label,
+            'requests': state.requests,
+            'failures': state.failures,
+            'success_rate': state.success_rate,
+            'latency_ms': state.latency * 1000 if state.latency is not None else None,
+            'cooldown_s': max(0.0, state.cooldown_until - now),
+        } for state in self.states])
+
+
+class PooledDouyinCrawler:
+    """The DouyinWebCrawler calls the scripts make, sent through a ProxyPool.
+
+    DouyinWebCrawler opens a new client for every call, this builds the same signed endpoints
+    and reuses the pool's per-proxy connections instead.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+
+    def endpoint(self, url, params):
+        params_dict = params.dict()
+        params_dict["msToken"] = ''
+        a_bogus = BogusManager.ab_model_2_endpoint(params_dict, self.pool.headers["User-Agent"])
+        return f"{url}?{urlencode(params_dict)}&a_bogus={a_bogus}"
+
+    async def fetch_one_video(self, aweme_id):
+        return await self.pool.fetch_get_json(self.endpoint(DouyinAPIEndpoints.POST_DETAIL, PostDetail(aweme_id=aweme_id)))
+
+    async def fetch_related_videos(self, aweme_id, filterGids="", count=20):
+        params = PostRelated(aweme_id=aweme_id, filterGids=filterGids, count=count)
+        return await self.pool.fetch_get_json(self.endpoint(DouyinAPIEndpoints.POST_RELATED, params))
+
+    async def fetch_user_post_videos(self, sec_uid, max_cursor, count):
+        params = UserPost(sec_uid=sec_uid, max_cursor=max_cursor, count=count)
+        return await self.pool.fetch_get_json(self.endpoint(DouyinAPIEndpoints.USER_POST, params))
@@ -1,176 +1,250 @@
+import argparse
 import asyncio
 import datetime
 import os
 import polars as pl
 import requests
 from tqdm import tqdm
-from douyin_scraper.douyin.web.web_crawler import DouyinWebCrawler
+
+from corpus import VideoCorpus
+from density import DensityScheduler, build_prior
+from frontier import Frontier
+from part_store import PartStore
+from probe_index import ProbeOutcomes, load_probe_index
+from raw_segments import SegmentWriter, flatten_response
+from retries import DeadLetters, RetryScheduler
+from writer import BatchWriter
+from concurrency import AIMDLimiter
+from metrics import Metrics
+from probe_ledger import ProbeLedger
+from proxy_pool import PROXIES_PATH, PooledDouyinCrawler, ProxyPool, load_proxies
 
 
 class AsyncDouyinScraper:
-    def __init__(self, num_workers=10, batch_size=10):
-        self.num_workers = num_workers
+    def __init__(self, num_workers=10, batch_size=10, min_workers=1, max_workers=64, start_time=None, end_time=None,
+                 schedule='sequential', n_sections=16, metrics=None, max_latency=5.0, proxies=None, max_attempts=5,
+                 replay_dead_letters=False, proxy_report=False):
+        # num_workers is the starting number of in-flight requests, the limiter adapts it
+        # between min_workers and max_workers to what the endpoint tolerates
+        self.num_workers = max_workers
+        self.limiter = AIMDLimiter(initial=num_workers, floor=min_workers, ceiling=max_workers)
         self.batch_size = batch_size
+        # a batch is written once it is full or its oldest result has waited max_latency seconds
+        self.max_latency = max_latency
+        self.start_time = start_time or datetime.datetime(2023, 6, 1, 10, 0, 0)
+        self.end_time = end_time
+        self.schedule = schedule
+        self.n_sections = n_sections
+        self.scheduler = None
+        self.max_attempts = max_attempts
+        self.replay_dead_letters = replay_dead_letters
+        self.proxy_report = proxy_report
+        # retries get a few workers of their own so they neither starve nor wait behind fresh ids
+        self.num_retry_workers = max(1, max_workers // 8)
         self.sampled_path = './data/douyin_sample_related_videos.parquet.zstd'
-        self.work_queue = asyncio.Queue()
-        self.results_queue = asyncio.Queue()
-        self.processed_ids = set()
-        self.save_lock = asyncio.Lock()
+        self.store = PartStore('./data/douyin_sample_related_videos')
+        # new responses are captured raw, project_segments.py turns them into typed tables
+        self.segments = SegmentWriter('./data/douyin_sample_related_videos_raw')
+        self.work_queue = asyncio.Queue(maxsize=max_workers * 4)
+        self.writer = None
         self.pbar = tqdm()
-        self.stop_workers = False
+        self.metrics = metrics or Metrics()
+        # requests are spread over the proxies, or all go through the configured one
+        self.pool = ProxyPool(proxies, connections_per_proxy=max_workers, metrics=self.metrics)
+        self.crawler = PooledDouyinCrawler(self.pool)
+        self.metrics.gauge('queue_depth', self.work_queue.qsize, queue='work')
+        self.metrics.gauge('concurrency_limit', lambda: self.limiter.limit)
+        self.metrics.gauge('in_flight', lambda: self.limiter.in_flight)
         
     async def load_data(self):
         """Load existing sampled data and video data"""
-        if os.path.exists(self.sampled_path):
-            self.sampled_df = pl.read_parquet(self.sampled_path)
-            self.processed_ids = set(self.sampled_df['aweme_id'].to_list())
-        else:
-            self.sampled_df = pl.DataFrame({'aweme_id': [], 'result': []})
+        # results written before the store existed become its first part
+        self.store.import_file(self.sampled_path)
+        self.index = load_probe_index('./data/douyin_sample_related_videos_index', self.store)
+        self.frontier = Frontier('./data/douyin_sample_related_videos_frontier.json')
+        # misses and failures are kept as status bits, only hits get their payload written
+        self.outcomes = ProbeOutcomes('./data/douyin_sample_related_videos_outcomes')
+        # failed ids are retried with backoff, the ones that keep failing are set aside for a replay
+        self.dead_letters = DeadLetters('./data/douyin_sample_related_videos_dead_letters')
+        self.retries = RetryScheduler(self.dead_letters, max_attempts=self.max_attempts)
+        self.metrics.gauge('retries_pending', self.retries.pending)
             
-        video_df = pl.read_parquet('./data/douyin_related_videos.parquet.zstd', columns=['aweme_id'])
-        video_df = video_df.with_columns([
-            pl.col('aweme_id').cast(pl.UInt64).map_elements(lambda i: format(i, '064b'), pl.String).alias('aweme_id_bits')
-        ]).with_columns([
-            pl.from_epoch(pl.col('aweme_id_bits').str.slice(0, 32).map_elements(lambda x: int(x, 2), pl.Int64)).alias('timestamp'),
-            pl.col('aweme_id_bits').str.slice(32, 10).map_elements(lambda x: int(x, 2), pl.Int64).alias('millisecond'),
-            pl.col('aweme_id_bits').str.slice(42, 22).alias('section_bits')
-        ])
-        
-        section_df = video_df.group_by(pl.col('section_bits'))\
-            .agg(pl.count().alias('count'))\
-            .sort('count', descending=True)
-        
-        self.sections = section_df.head(1)['section_bits'].to_list()
+        if self.schedule == 'density':
+            hours, milliseconds, sections = build_prior(VideoCorpus().catalog, n_sections=self.n_sections)
+            end_time = self.end_time or datetime.datetime.now()
+            self.scheduler = DensityScheduler(
+                hours, milliseconds, sections,
+                int(self.start_time.timestamp()), int(end_time.timestamp()),
+                stats_path='./data/douyin_sample_related_videos_density.parquet'
+            )
+        else:
+            self.sections = VideoCorpus().catalog.most_common(n=1)
+        # the same bookkeeping of probed, failed and retried ids as the post detail engine
+        self.ledger = ProbeLedger(self.index, self.outcomes, self.frontier, self.retries, self.metrics,
+                                  on_abandon=self.scheduler.release if self.scheduler is not None else None)
         
     async def id_generator(self):
         """Generate aweme IDs to be processed"""
-        start_time = datetime.datetime(2023, 6, 1, 10, 0, 0)
-        current_time = start_time
-        milliseconds = 0
-        
-        while not self.stop_workers:
-            if milliseconds >= 1000:
-                milliseconds = 0
-                current_time += datetime.timedelta(seconds=1)
-                
-            timestamp_bits = format(int(current_time.timestamp()), '032b')
-            milliseconds_bits = format(milliseconds, '010b')
-            all_bits = timestamp_bits + milliseconds_bits + self.sections[0]
-            aweme_id = str(int(all_bits, 2))
-            
-            if aweme_id not in self.processed_ids:
-                await self.work_queue.put(aweme_id)
-                self.processed_ids.add(aweme_id)
-                
-            milliseconds += 1
-            
-            # Prevent queue from growing too large
-            if self.work_queue.qsize() > self.num_workers * 10:
-                await asyncio.sleep(0.1)
-                
+        if self.replay_dead_letters:
+            aweme_ids = self.dead_letters.ids(self.index)
+            print(f"Replaying {len(aweme_ids)} dead-lettered ids.")
+        elif self.scheduler is not None:
+            aweme_ids = self.scheduler.ids(self.index)
+        else:
+            start = int(self.start_time.timestamp())
+            end = int(self.end_time.timestamp()) if self.end_time else None
+            # Resumes from the saved frontier instead of replaying everything since start_time
+            aweme_ids = self.frontier.walk(self.index, self.sections[0], start, end)
+
+        # The queue is bounded, so this waits whenever the workers are behind
+        for aweme_id in aweme_ids:
+            await self.work_queue.put(aweme_id)
+
+        # End of the window, each worker stops after what is queued before its sentinel
+        for _ in range(self.num_workers):
+            await self.work_queue.put(None)
+
     async def worker(self, worker_id):
         """Worker that fetches related videos"""
-        crawler = DouyinWebCrawler()
-        cols_to_remove = ['duet_origin_item', 'show_follow_button', 'entertainment_product_info']
-        
-        while not self.stop_workers:
-            try:
-                # Get work item with timeout to allow checking stop_workers
-                aweme_id = await asyncio.wait_for(self.work_queue.get(), timeout=1.0)
-            except asyncio.TimeoutError:
-                continue
-                
-            self.pbar.update(1)
-            
-            try:
-                response = await crawler.fetch_related_videos(aweme_id)
-                
-                # Clean response
-                response['aweme_list'] = [
-                    {k: v for k, v in item.items() if k not in cols_to_remove} 
-                    for item in response['aweme_list']
-                ]
-                
-                await self.results_queue.put({
-                    'aweme_id': aweme_id,
-                    'result': response
-                })
-                
-            except Exception as e:
-                print(f"Worker {worker_id} - Error fetching data for video ID {aweme_id}: {e}")
-                
-    async def result_processor(self):
-        """Process and save results in batches"""
-        all_results = []
-        
-        while not self.stop_workers or not self.results_queue.empty():
-            try:
-                # Get result with timeout
-                result = await asyncio.wait_for(self.results_queue.get(), timeout=1.0)
-                all_results.append(result)
-            except asyncio.TimeoutError:
-                pass
-                
-            # Save batch when threshold reached
-            if len(all_results) >= self.batch_size:
-                await self.save_batch(all_results)
-                all_results = []
-                
-        # Save any remaining results
-        if all_results:
-            await self.save_batch(all_results)
-            
-    async def save_batch(self, results):
-        """Save a batch of results to parquet file"""
-        async with self.save_lock:
-            new_df = pl.from_dicts(results, infer_schema_length=len(results), strict=False)
-            self.sampled_df = pl.concat([self.sampled_df, new_df], how='diagonal_relaxed')
-            
-            self.sampled_df.write_parquet(self.sampled_path, compression='zstd')
-            self.sampled_df.write_parquet(
-                self.sampled_path.replace('videos', 'videos_bckup'), 
-                compression='zstd'
-            )
-            
+        while True:
+            aweme_id = await self.work_queue.get()
+            if aweme_id is None:
+                return
+            await self.probe(aweme_id, worker_id)
+
+    async def retry_worker(self, worker_id):
+        """Worker that fetches the failed ids as their retries come due"""
+        async for aweme_id in self.retries.due():
+            await self.probe(aweme_id, worker_id)
+
+    async def probe(self, aweme_id, worker_id):
+        """Fetch the related videos of one id and queue the result for writing"""
+        self.pbar.update(1)
+
+        try:
+            async with self.limiter.slot() as slot:
+                with self.metrics.timer('fetch_seconds', endpoint='related'):
+                    response = await self.crawler.fetch_related_videos(aweme_id)
+                # A throttled request comes back without a body rather than an empty list
+                if not response or 'aweme_list' not in response:
+                    slot.fail('empty')
+                    self.metrics.inc('probes_total', outcome='empty')
+                    self.ledger.failed(aweme_id, 'empty')
+                    print(f"Worker {worker_id} - Empty response for video ID {aweme_id}")
+                    return
+            self.metrics.inc('probes_total', outcome='hit' if response['aweme_list'] else 'miss')
+            self.pbar.set_postfix(limit=self.limiter.limit, refresh=False)
+            if self.scheduler is not None:
+                self.scheduler.record(aweme_id, bool(response['aweme_list']))
+
+            # Only the projected fields of each post are queued and written
+            response = flatten_response(response)
+
+        except Exception as e:
+            self.metrics.inc('probes_total', outcome='error')
+            self.metrics.inc('fetch_errors_total', type=type(e).__name__)
+            self.ledger.failed(aweme_id, 'error', repr(e))
+            print(f"Worker {worker_id} - Error fetching data for video ID {aweme_id}: {e}")
+            return
+
+        # Waits when the writer is behind, which holds back this worker's next request
+        await self.writer.put({
+            'aweme_id': aweme_id,
+            'result': response
+        })
+        self.ledger.succeeded(aweme_id)
+
+    def write_batch(self, results):
+        """Append the hits of a batch to the current segment, runs on the writer thread"""
+        hits = [result for result in results if result['result']['aweme_list']]
+        with self.metrics.timer('flush_seconds', stage='segments'):
+            num_bytes = self.segments.append_records(hits)
+        self.metrics.inc('records_written_total', len(hits))
+        self.metrics.inc('bytes_written_total', num_bytes)
+
+    def record_batch(self, results):
+        """Mark a written batch as probed, runs on the event loop"""
+        with self.metrics.timer('flush_seconds', stage='index'):
+            self.ledger.written([
+                (result['aweme_id'], 'hit' if result['result']['aweme_list'] else 'miss') for result in results
+            ])
+
     async def run(self):
         """Main execution method"""
         await self.load_data()
-        
-        # Create tasks
-        tasks = []
-        
-        # ID generator task
-        tasks.append(asyncio.create_task(self.id_generator()))
-        
-        # Worker tasks
-        for i in range(self.num_workers):
-            tasks.append(asyncio.create_task(self.worker(i)))
-            
-        # Result processor task
-        tasks.append(asyncio.create_task(self.result_processor()))
-        
+        await self.pool.open()
+
+        self.writer = BatchWriter(self.write_batch, on_written=self.record_batch,
+                                  batch_size=self.batch_size, max_latency=self.max_latency).start()
+        self.metrics.gauge('queue_depth', self.writer.qsize, queue='results')
+        workers = [asyncio.create_task(self.worker(i)) for i in range(self.num_workers)]
+        retry_workers = [asyncio.create_task(self.retry_worker(f"retry-{i}")) for i in range(self.num_retry_workers)]
+
         try:
-            # Run until interrupted
-            await asyncio.gather(*tasks)
-        except KeyboardInterrupt:
-            print("\nShutting down gracefully...")
-            self.stop_workers = True
-            
-            # Wait for tasks to complete
-            await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # Final save
-            await self.save_batch([])
-            
+            await self.id_generator()
+            await asyncio.gather(*workers)
+            # Fresh ids are done, wait for the retries to succeed or run out of attempts
+            self.retries.close()
+            await asyncio.gather(*retry_workers)
         finally:
+            # Interrupted: stop fetching, then write out whatever was already fetched
+            for worker in workers + retry_workers:
+                worker.cancel()
+            await asyncio.gather(*workers, *retry_workers, return_exceptions=True)
+            await self.writer.close()
+            self.dead_letters.close()
+            if self.proxy_report:
+                with pl.Config(tbl_rows=-1):
+                    print(self.pool.report())
+            await self.pool.close()
+
+            self.segments.close()
+            self.index.checkpoint()
+            self.outcomes.checkpoint()
+            self.frontier.save()
+            if self.scheduler is not None:
+                self.scheduler.save()
+                print(self.scheduler.report().head(20))
             self.pbar.close()
             print("Scraping completed.")
 
 
 async def main():
-    # Adjust num_workers based on your API rate limits and system capabilities
-    scraper = AsyncDouyinScraper(num_workers=8, batch_size=256)
-    await scraper.run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--start', type=datetime.datetime.fromisoformat, default=datetime.datetime(2023, 6, 1, 10, 0, 0),
+                        help="start of the id window, a saved frontier past it takes precedence")
+    parser.add_argument('--end', type=datetime.datetime.fromisoformat, default=None,
+                        help="stop once the window up to this time has been probed")
+    parser.add_argument('--schedule', choices=['sequential', 'density'], default='sequential',
+                        help="probe every millisecond in order, or the densest regions of the known ids first")
+    parser.add_argument('--sections', type=int, default=16, help="number of sections the density schedule covers")
+    parser.add_argument('--max-attempts', type=int, default=5, help="attempts per id before it is dead-lettered")
+    parser.add_argument('--replay-dead-letters', action='store_true', help="probe only the dead-lettered ids, then stop")
+    parser.add_argument('--proxies', default=PROXIES_PATH, help="file with one proxy url per line to spread requests over")
+    parser.add_argument('--proxy-report', action='store_true', help="print requests, failures and latency per proxy at the end")
+    parser.add_argument('--metrics-port', type=int, default=None, help="serve prometheus metrics on this port")
+    parser.add_argument('--metrics-log', default='./data/douyin_sample_related_videos_metrics.jsonl',
+                        help="file the metrics are appended to as json lines")
+    parser.add_argument('--metrics-interval', type=float, default=30.0, help="seconds between metrics snapshots")
+    args = parser.parse_args()
+
+    metrics = Metrics()
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+
+    # Concurrency adapts to the API rate limits, min_workers/max_workers bound it
+    scraper = AsyncDouyinScraper(num_workers=8, batch_size=256, min_workers=1, max_workers=64,
+                                 start_time=args.start, end_time=args.end,
+                                 schedule=args.schedule, n_sections=args.sections, metrics=metrics,
+                                 proxies=load_proxies(args.proxies), max_attempts=args.max_attempts,
+                                 replay_dead_letters=args.replay_dead_letters, proxy_report=args.proxy_report)
+    snapshots = asyncio.create_task(metrics.write_snapshots(args.metrics_log, args.metrics_interval))
+    try:
+        await scraper.run()
+    finally:
+        snapshots.cancel()
+        await asyncio.gather(snapshots, return_exceptions=True)
+        metrics.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,253 @@
+import glob
+import gzip
+import json
+import os
+import time
+import zlib
+
+import polars as pl
+
+from part_store import PartStore
+
+
+class SegmentWriter:
+    """Appends raw responses as gzip compressed NDJSON segments, no schema involved.
+
+    Each append is written as its own gzip member and fsynced, so a crash loses at most the
+    batch being written. Segments are sealed (renamed from .open) once they reach
+    max_segment_bytes or the writer is closed; only sealed segments are projected.
+    """
+    def __init__(self, path, max_segment_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_segment_bytes = max_segment_bytes
+        self.current = None
+        os.makedirs(path, exist_ok=True)
+        # segments left open by a previous run are complete up to their last whole member, a member
+        # torn by a crash during its write is cut off before the segment is sealed
+        for open_path in glob.glob(os.path.join(path, '*.ndjson.gz.open')):
+            truncate_to_complete_members(open_path)
+            os.replace(open_path, open_path[:-len('.open')])
+
+    def _new_segment(self):
+        name = f"segment-{time.time_ns()}-{os.getpid()}.ndjson.gz"
+        return os.path.join(self.path, name + '.open')
+
+    def append_records(self, records):
+        """Append records as one gzip member, returns the compressed bytes written"""
+        if not records:
+            return 0
+        if self.current is None:
+            self.current = self._new_segment()
+        fetched_at = time.time()
+        lines = ''.join(
+            json.dumps(dict(record, fetched_at=record.get('fetched_at', fetched_at)), ensure_ascii=False) + '\n'
+            for record in records
+        )
+        data = gzip.compress(lines.encode('utf-8'))
+        with open(self.current, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.getsize(self.current) >= self.max_segment_bytes:
+            self.seal()
+        return len(data)
+
+    def seal(self):
+        if self.current is not None:
+            os.replace(self.current, self.current[:-len('.open')])
+            self.current = None
+
+    def close(self):
+        self.seal()
+
+
+def truncate_to_complete_members(segment_path):
+    """Cut a segment back to its last complete gzip member, returns the bytes removed"""
+    with open(segment_path, 'rb') as f:
+        data = f.read()
+    length = 0
+    while length < len(data):
+        member = zlib.decompressobj(wbits=31)
+        try:
+            member.decompress(data[length:])
+        except zlib.error:
+            break
+        if not member.eof:
+            break
+        length = len(data) - len(member.unused_data)
+    if length < len(data):
+        print(f"Truncating torn segment {segment_path} from {len(data)} to {length} bytes")
+        with open(segment_path, 'r+b') as f:
+            f.truncate(length)
+            os.fsync(f.fileno())
+    return len(data) - length
+
+
+def sealed_segments(path):
+    return sorted(glob.glob(os.path.join(path, '*.ndjson.gz')))
+
+
+def read_segment(segment_path):
+    """Records of a segment, up to a torn trailing member of a segment sealed before recovery truncated them"""
+    try:
+        with gzip.open(segment_path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                # every member ends with a newline, a line without one was cut off
+                if not line.endswith('\n'):
+                    break
+                if line.strip():
+                    yield json.loads(line)
+    except (EOFError, gzip.BadGzipFile, zlib.error) as e:
+        print(f"Stopped reading torn segment {segment_path}: {e}")
+
+
+def _get(value, path):
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def _path_expr(schema, path, dtype):
+    """Expression reading path through nested struct columns, null where a field is missing"""
+    fields = dict(schema)
+    expr = None
+    for key in path:
+        if key not in fields:
+            return pl.lit(None, dtype=dtype)
+        expr = pl.col(key) if expr is None else expr.struct.field(key)
+        field_dtype = fields[key]
+        fields = {field.name: field.dtype for field in field_dtype.fields} if isinstance(field_dtype, pl.Struct) else {}
+    return expr.cast(dtype, strict=False)
+
+
+class Projection:
+    """Versioned mapping from raw response records to a typed table.
+
+    `rows` is the path of the list (or single object) inside each record that becomes one row per
+    element (None for one row per record), `columns` maps output names to (path inside the row,
+    dtype) and `record_columns` to (path inside the record, dtype). Fields not listed are ignored,
+    so new fields in the API never break projection. Rows already flattened at ingest carry the
+    output names as keys and are read as they are.
+    """
+    def __init__(self, name, version, columns, rows=None, record_columns=None):
+        self.name = name
+        self.version = version
+        self.columns = columns
+        self.rows = rows
+        self.record_columns = record_columns or {}
+
+    @property
+    def schema(self):
+        schema = {name: dtype for name, (_, dtype) in self.record_columns.items()}
+        schema.update({name: dtype for name, (_, dtype) in self.columns.items()})
+        return schema
+
+    def flatten(self, item):
+        """Only the configured columns of one row, as a flat dict keyed by output name"""
+        return {name: item[name] if name in item else _get(item, path) for name, (path, _) in self.columns.items()}
+
+    def project_frame(self, df):
+        """The configured columns of a frame with one row per element, e.g. posts read back from parquet"""
+        return df.select(
+            _path_expr(df.schema, (name,) if name in df.columns else path, dtype).alias(name)
+            for name, (path, dtype) in self.columns.items()
+        )
+
+    def project_records(self, records):
+        data = {name: [] for name in self.schema}
+        for record in records:
+            record_values = {name: _get(record, path) for name, (path, _) in self.record_columns.items()}
+            items = [record] if self.rows is None else _get(record, self.rows)
+            if isinstance(items, dict):
+                items = [items]
+            for item in items or []:
+                for name, value in record_values.items():
+                    data[name].append(value)
+                for name, value in self.flatten(item).items():
+                    data[name].append(value)
+        return pl.DataFrame(data, schema=self.schema, strict=False)
+
+
+AWEME_COLUMNS = {
+    'aweme_id': (('aweme_id',), pl.String),
+    'desc': (('desc',), pl.String),
+    'create_time': (('create_time',), pl.Int64),
+    'author_uid': (('author', 'uid'), pl.String),
+    'author_sec_uid': (('author', 'sec_uid'), pl.String),
+    'author_nickname': (('author', 'nickname'), pl.String),
+    'music_id': (('music', 'id_str'), pl.String),
+    'music_title': (('music', 'title'), pl.String),
+    'duration': (('duration',), pl.Int64),
+    'play_count': (('statistics', 'play_count'), pl.Int64),
+    'digg_count': (('statistics', 'digg_count'), pl.Int64),
+    'comment_count': (('statistics', 'comment_count'), pl.Int64),
+    'share_count': (('statistics', 'share_count'), pl.Int64),
+    'collect_count': (('statistics', 'collect_count'), pl.Int64),
+}
+
+# the fields kept of every post, everything else is dropped as soon as a response arrives
+AWEME = Projection('aweme', 1, columns=AWEME_COLUMNS)
+
+
+def flatten_response(response):
+    """Reduce a post detail or related videos response to flat posts before it is buffered"""
+    flat = {'status_code': response.get('status_code')}
+    if 'aweme_detail' in response:
+        detail = response['aweme_detail']
+        flat['aweme_detail'] = AWEME.flatten(detail) if detail else None
+    if 'aweme_list' in response:
+        flat['aweme_list'] = [AWEME.flatten(item) for item in response['aweme_list'] or []]
+    return flat
+
+
+PROJECTIONS = {
+    'related': Projection(
+        'related', 1,
+        columns=AWEME_COLUMNS,
+        rows=('result', 'aweme_list'),
+        record_columns={
+            'source_aweme_id': (('aweme_id',), pl.String),
+            'fetched_at': (('fetched_at',), pl.Float64),
+        },
+    ),
+    # misses are not stored any more, so there is one row per post found
+    'detail': Projection(
+        'detail', 2,
+        columns=AWEME_COLUMNS,
+        rows=('result', 'aweme_detail'),
+        record_columns={
+            'probe_aweme_id': (('aweme_id',), pl.String),
+            'fetched_at': (('fetched_at',), pl.Float64),
+            'status_code': (('result', 'status_code'), pl.Int64),
+        },
+    ),
+}
+
+
+def project(segments_path, projection, out_path):
+    """Project every sealed segment not yet projected with this projection version, returns a lazy table.
+
+    Output goes to a PartStore under out_path/<name>-v<version>, so a schema change projects into a
+    fresh table while older versions stay readable.
+    """
+    store = PartStore(os.path.join(out_path, f"{projection.name}-v{projection.version}"))
+    done_path = os.path.join(store.path, 'projected_segments.json')
+    done = set()
+    if os.path.exists(done_path):
+        with open(done_path, 'r') as f:
+            done = set(json.load(f))
+
+    for segment_path in sealed_segments(segments_path):
+        name = os.path.basename(segment_path)
+        if name in done:
+            continue
+        store.append(projection.project_records(read_segment(segment_path)))
+        done.add(name)
+        tmp_path = done_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(sorted(done), f)
+        os.replace(tmp_path, done_path)
+
+    return store.scan()
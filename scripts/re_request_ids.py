@@ -1,74 +1,87 @@
+import argparse
 import asyncio
-import datetime
-import os
-from urllib.parse import urlencode
+import time
 
 import polars as pl
-import requests
 from tqdm import tqdm
 
-from douyin_scraper.douyin.web.web_crawler import DouyinWebCrawler
-from douyin_scraper.base_crawler import BaseCrawler
-from douyin_scraper.douyin.web.endpoints import DouyinAPIEndpoints
-from douyin_scraper.douyin.web.models import PostDetail
-from douyin_scraper.douyin.web.utils import BogusManager
+from corpus import VideoCorpus
+from fetch_engine import PostDetailEngine
+from part_store import PartStore
+from proxy_pool import PROXIES_PATH, load_proxies
+from refresh import SECONDS_PER_DAY, RefreshSchedule, StatsSeries, statistics_response
+from retries import RetryScheduler
 
-async def main():
-    video_df = pl.read_parquet('./data/douyin_related_videos.parquet.zstd', columns=['aweme_id'])
-    video_df = video_df.with_columns([
-        pl.col('aweme_id').cast(pl.UInt64).map_elements(lambda i: format(i, '064b'), pl.String).alias('aweme_id_bits')
-    ]).with_columns([
-        pl.from_epoch(pl.col('aweme_id_bits').str.slice(0, 32).map_elements(lambda x: int(x, 2), pl.Int64)).alias('timestamp'),
-        pl.col('aweme_id_bits').str.slice(32, 10).map_elements(lambda x: int(x, 2), pl.Int64).alias('millisecond'),
-        pl.col('aweme_id_bits').str.slice(42, 22).alias('section_bits')
-    ])
-    section_df = video_df.group_by(pl.col('section_bits'))\
-        .agg(pl.count().alias('count'))\
-        .sort('count', descending=True)
-    sections = section_df.head(1)['section_bits'].to_list()
 
-    crawler = DouyinWebCrawler()
+async def refresh_pass(args, series, schedule):
+    """Snapshot the statistics of every video that is due, returns the number refreshed"""
+    video_df = VideoCorpus().scan(columns=['aweme_id']).collect()
+    due_df = schedule.due(video_df, series.latest(), limit=args.limit)
+    print(f"{due_df.height} of {video_df.height} videos due for a refresh.")
+    if due_df.height == 0:
+        return 0
+
+    # a failed refresh leaves the video due, so it is simply picked up again by the next pass
+    retries = RetryScheduler(max_attempts=3)
+    pbar = tqdm(total=due_df.height)
+    try:
+        async with PostDetailEngine(concurrency=args.concurrency, batch_size=256, proxies=load_proxies(args.proxies)) as engine:
+            await engine.run(due_df['aweme_id'], series, pbar=pbar, flatten=statistics_response, retries=retries)
+    finally:
+        series.store.wait_for_compaction()
+        pbar.close()
+    return due_df.height
 
-    # result = await crawler.fetch_one_video(video_df['aweme_id'].to_list()[0])
 
-    start_time = datetime.datetime(2025, 6, 1, 10, 0, 0)
-    current_time = start_time
-    milliseconds = 0
+async def full_pass(args):
+    """Re-request the full details of every known video once"""
+    video_df = VideoCorpus().scan(columns=['aweme_id']).collect()
+    store = PartStore('./data/douyin_re_requested_videos', auto_compact=True)
 
-    kwargs = await crawler.get_douyin_headers()
-    # 创建一个基础爬虫
-    base_crawler = BaseCrawler(proxies=kwargs["proxies"], crawler_headers=kwargs["headers"])
-    # 生成一个作品详情的带有a_bogus加密参数的Endpoint
-    # 创建一个作品详情的BaseModel参数
-    params = PostDetail(aweme_id='')
-    params_dict = params.dict()
-    params_dict["msToken"] = ''
-    a_bogus = BogusManager.ab_model_2_endpoint(params_dict, kwargs["headers"]["User-Agent"])
+    pbar = tqdm(total=video_df.height)
+    try:
+        async with PostDetailEngine(concurrency=args.concurrency, batch_size=256, proxies=load_proxies(args.proxies)) as engine:
+            await engine.run(video_df['aweme_id'].cast(pl.String), store, pbar=pbar)
+    finally:
+        store.wait_for_compaction()
+        pbar.close()
 
-    pbar = tqdm()
-    all_results = []
-    for video in video_df.to_dicts():
-        aweme_id = video['aweme_id']
 
-        pbar.update(1)
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=['refresh', 'full'], default='refresh',
+                        help="statistics snapshots of the videos that are due, or the full details of every video")
+    parser.add_argument('--watch', action='store_true', help="refresh mode: keep refreshing as videos become due")
+    parser.add_argument('--limit', type=int, default=None, help="refresh mode: most videos refreshed per pass")
+    parser.add_argument('--min-interval-hours', type=float, default=1.0, help="refresh mode: shortest time between snapshots")
+    parser.add_argument('--max-interval-days', type=float, default=14.0, help="refresh mode: longest time between snapshots")
+    parser.add_argument('--age-factor', type=float, default=0.1,
+                        help="refresh mode: time between snapshots as a share of the video's age")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--proxies', default=PROXIES_PATH, help="file with one proxy url per line to spread requests over")
+    args = parser.parse_args()
 
-        try:
-            async with base_crawler as crawler:
-                # 生成一个作品详情的带有加密参数的Endpoint
-                # 2024年6月12日22:41:44 由于XBogus加密已经失效，所以不再使用XBogus加密参数，转移至a_bogus加密参数。
-                # endpoint = BogusManager.xb_model_2_endpoint(
-                #     DouyinAPIEndpoints.POST_DETAIL, params.dict(), kwargs["headers"]["User-Agent"]
-                # )
-                params_dict['aweme_id'] = aweme_id
-                endpoint = f"{DouyinAPIEndpoints.POST_DETAIL}?{urlencode(params_dict)}&a_bogus={a_bogus}"
+    if args.mode == 'full':
+        await full_pass(args)
+        return
 
-                response = await crawler.fetch_get_json(endpoint)
-                all_results.append({
-                    'aweme_id': aweme_id,
-                    'result': response
-                })
-        except Exception as e:
-            print(f"Error fetching data for video ID {aweme_id}: {e}")
+    series = StatsSeries()
+    schedule = RefreshSchedule(
+        min_interval=int(args.min_interval_hours * 3600),
+        max_interval=int(args.max_interval_days * SECONDS_PER_DAY),
+        age_factor=args.age_factor,
+    )
+    try:
+        while True:
+            await refresh_pass(args, series, schedule)
+            if not args.watch:
+                break
+            next_due = schedule.next_due(VideoCorpus().scan(columns=['aweme_id']).collect(), series.latest())
+            wait = max(0, (next_due or 0) - time.time())
+            # new videos in the corpus are due right away, so look again at least every min interval
+            await asyncio.sleep(min(max(wait, 60), schedule.min_interval))
+    finally:
+        series.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,168 @@
+import time
+
+import polars as pl
+
+from aweme_ids import TIMESTAMP_SHIFT
+from part_store import PartStore
+
+STATS_PATH = './data/douyin_video_stats'
+STAT_COLUMNS = ('play_count', 'digg_count', 'comment_count', 'share_count', 'collect_count')
+SNAPSHOT_SCHEMA = {
+    'aweme_id': pl.String,
+    'fetched_at': pl.Int64,
+    'seq': pl.Int64,
+    'since_previous': pl.Int64,
+    'available': pl.Boolean,
+    **{column: pl.Int64 for column in STAT_COLUMNS},
+}
+SECONDS_PER_DAY = 86400
+
+
+def statistics_response(response):
+    """Reduce a post detail response to the statistics a snapshot keeps, used as the engine's flatten"""
+    detail = response.get('aweme_detail') or {}
+    return {'statistics': detail.get('statistics')}
+
+
+class StatsSeries:
+    """Engagement time series of the corpus, one delta-encoded statistics snapshot per refresh.
+
+    A row holds the change of every counter since the previous snapshot of the same video and
+    the seconds elapsed since it, the first snapshot of a video being a change from zero.
+    Snapshots are numbered by `seq` in the order they were taken, which orders the ones
+    within the same second of fetched_at. Most counters barely move between refreshes, so
+    the rows are mostly small numbers and zeros that compress to next to nothing. scan()
+    sums them back into absolute values.
+    """
+    def __init__(self, path=STATS_PATH):
+        self.store = PartStore(path, auto_compact=True)
+        self._previous = None
+        self._seq = None
+
+    def _scan(self):
+        scan = self.store.scan()
+        # snapshots taken before they were numbered come first within their second
+        if 'seq' not in scan.collect_schema():
+            scan = scan.with_columns(pl.lit(None, dtype=pl.Int64).alias('seq'))
+        return scan
+
+    def latest(self):
+        """Current absolute counters of every video, with when and how much play_count last changed"""
+        if not self.store.parts():
+            return pl.DataFrame(schema={
+                'aweme_id': pl.String, 'fetched_at': pl.Int64, 'seq': pl.Int64, 'since_previous': pl.Int64, 'available': pl.Boolean,
+                **{column: pl.Int64 for column in STAT_COLUMNS}, 'play_count_change': pl.Int64,
+            })
+        return self._scan()\
+            .sort('fetched_at', 'seq', maintain_order=True)\
+            .group_by('aweme_id')\
+            .agg(
+                pl.col('fetched_at').last(),
+                pl.col('seq').last(),
+                pl.col('since_previous').last(),
+                pl.col('available').last(),
+                *[pl.col(column).sum() for column in STAT_COLUMNS],
+                pl.col('play_count').last().alias('play_count_change'),
+            )\
+            .collect()
+
+    def scan(self):
+        """Every snapshot with absolute counters"""
+        return self._scan()\
+            .sort('aweme_id', 'fetched_at', 'seq', maintain_order=True)\
+            .with_columns(pl.col(column).cum_sum().over('aweme_id') for column in STAT_COLUMNS)
+
+    def _load_previous(self):
+        latest = self.latest()
+        self._seq = latest['seq'].max() or 0
+        self._previous = {
+            row[0]: (row[1], row[2:])
+            for row in latest.select('aweme_id', 'fetched_at', *STAT_COLUMNS).iter_rows()
+        }
+
+    def append_records(self, records):
+        """Append the snapshots of engine records, {'aweme_id', 'result': statistics_response(...)}"""
+        if self._previous is None:
+            self._load_previous()
+        fetched_at = int(time.time())
+        rows = []
+        for record in records:
+            aweme_id = record['aweme_id']
+            statistics = record['result'].get('statistics')
+            previous_at, previous = self._previous.get(aweme_id, (None, (0,) * len(STAT_COLUMNS)))
+            if statistics is None:
+                # deleted or private, kept at its last counters so the schedule backs off
+                values = previous
+            else:
+                # a counter missing from the response is unknown rather than zero
+                values = tuple(
+                    int(statistics[column]) if statistics.get(column) is not None else base
+                    for column, base in zip(STAT_COLUMNS, previous)
+                )
+            self._seq += 1
+            rows.append({
+                'aweme_id': aweme_id,
+                'fetched_at': fetched_at,
+                'seq': self._seq,
+                'since_previous': fetched_at - previous_at if previous_at is not None else 0,
+                'available': statistics is not None,
+                **{column: value - base for column, value, base in zip(STAT_COLUMNS, values, previous)},
+            })
+            self._previous[aweme_id] = (fetched_at, values)
+        return self.store.append(pl.DataFrame(rows, schema=SNAPSHOT_SCHEMA))
+
+    def close(self):
+        self.store.wait_for_compaction()
+
+
+class RefreshSchedule:
+    """When each video is due for its next snapshot, from its age and how fast it is growing.
+
+    A video is refreshed every `age_factor` of its age, so a day old video every couple of
+    hours and a month old one every few days, shortened by its relative daily play growth
+    since the last two snapshots and kept between min_interval and max_interval. Videos
+    without a snapshot are due right away, newest first; unavailable ones wait max_interval.
+    """
+    def __init__(self, min_interval=3600, max_interval=14 * SECONDS_PER_DAY, age_factor=0.1, growth_weight=1.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.age_factor = age_factor
+        self.growth_weight = growth_weight
+
+    def due_at(self, aweme_ids, latest, now):
+        """aweme_id, created_at and due_at of every video in the aweme_ids frame"""
+        created_at = (pl.col('aweme_id').cast(pl.UInt64) // pl.lit(1 << TIMESTAMP_SHIFT, dtype=pl.UInt64)).cast(pl.Int64)
+        previous_plays = pl.max_horizontal(pl.col('play_count') - pl.col('play_count_change'), pl.lit(1))
+        daily_growth = pl.when(pl.col('since_previous') > 0)\
+            .then(pl.col('play_count_change') / previous_plays * SECONDS_PER_DAY / pl.col('since_previous'))\
+            .otherwise(0.0)\
+            .clip(lower_bound=0.0)
+        age = (pl.lit(now) - pl.col('created_at')).clip(lower_bound=0)
+        interval = pl.when(pl.col('available').not_())\
+            .then(pl.lit(float(self.max_interval)))\
+            .otherwise(age * self.age_factor / (1 + self.growth_weight * daily_growth))\
+            .clip(self.min_interval, self.max_interval)
+        return aweme_ids.select(pl.col('aweme_id').cast(pl.String))\
+            .unique()\
+            .join(latest, on='aweme_id', how='left')\
+            .with_columns(created_at.alias('created_at'))\
+            .with_columns(
+                pl.when(pl.col('fetched_at').is_null())
+                .then(pl.lit(0))
+                .otherwise(pl.col('fetched_at') + interval.cast(pl.Int64))
+                .alias('due_at')
+            )\
+            .select('aweme_id', 'created_at', 'due_at')
+
+    def due(self, aweme_ids, latest, now=None, limit=None):
+        """Videos due by now, the longest overdue first and never refreshed ones newest first"""
+        now = int(now or time.time())
+        due = self.due_at(aweme_ids, latest, now)\
+            .filter(pl.col('due_at') <= now)\
+            .sort(['due_at', 'created_at'], descending=[False, True])
+        return due if limit is None else due.head(limit)
+
+    def next_due(self, aweme_ids, latest, now=None):
+        """Time the next video becomes due, None if there are no videos"""
+        now = int(now or time.time())
+        return self.due_at(aweme_ids, latest, now)['due_at'].min()
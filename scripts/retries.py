@@ -0,0 +1,106 @@
+import asyncio
+import heapq
+import random
+import time
+
+import polars as pl
+
+from part_store import PartStore
+
+DEAD_LETTER_SCHEMA = {'aweme_id': pl.String, 'attempts': pl.UInt16, 'error': pl.String, 'failed_at': pl.Float64}
+
+
+class DeadLetters:
+    """Ids that failed every retry, kept until they are replayed in bulk.
+
+    Nothing is ever removed: an id counts as replayed once it is in the probe index of the
+    crawl, so replaying is reading the ids that are not, and one that fails again is simply
+    added once more.
+    """
+    def __init__(self, path):
+        self.store = PartStore(path, auto_compact=True)
+        self.buffer = []
+
+    def add(self, aweme_id, attempts, error=None):
+        self.buffer.append({'aweme_id': aweme_id, 'attempts': attempts, 'error': error, 'failed_at': time.time()})
+
+    def flush(self):
+        if self.buffer:
+            self.store.append(pl.DataFrame(self.buffer, schema=DEAD_LETTER_SCHEMA))
+            self.buffer = []
+
+    def ids(self, index=None):
+        """Dead-lettered ids in order, without the ones in index, i.e. probed since"""
+        self.flush()
+        if not self.store.parts():
+            return []
+        ids = self.store.scan(columns=['aweme_id']).unique().sort('aweme_id').collect()['aweme_id'].to_list()
+        return [aweme_id for aweme_id in ids if index is None or aweme_id not in index]
+
+    def close(self):
+        self.flush()
+        self.store.wait_for_compaction()
+
+
+class RetryScheduler:
+    """Holds failed ids back for a jittered exponential backoff, apart from the queue of fresh ids.
+
+    Attempt n of an id waits a random delay of up to base_delay * 2 ** (n - 1) seconds, capped
+    at max_delay, so a burst of failures, e.g. while throttled, is not retried all at once.
+    Due ids come out of due(), which the crawlers read with their own few workers, so retries
+    neither starve fresh work nor wait behind it. An id that fails `max_attempts` times goes
+    to the dead letters instead.
+    """
+    def __init__(self, dead_letters=None, max_attempts=5, base_delay=1.0, max_delay=60.0, seed=None):
+        self.dead_letters = dead_letters
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rng = random.Random(seed)
+        self.heap = []
+        self.attempts = {}
+        self.closed = False
+        self._changed = asyncio.Event()
+
+    def failed(self, aweme_id, error=None):
+        """Schedule another attempt, returns False if the id was dead-lettered instead"""
+        attempts = self.attempts.get(aweme_id, 0) + 1
+        if attempts >= self.max_attempts:
+            self.attempts.pop(aweme_id, None)
+            if self.dead_letters is not None:
+                self.dead_letters.add(aweme_id, attempts, error)
+            self._changed.set()
+            return False
+        self.attempts[aweme_id] = attempts
+        delay = self.rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempts - 1)))
+        heapq.heappush(self.heap, (time.monotonic() + delay, aweme_id))
+        self._changed.set()
+        return True
+
+    def succeeded(self, aweme_id):
+        if self.attempts.pop(aweme_id, None) is not None:
+            self._changed.set()
+
+    def pending(self):
+        """Ids waiting for a retry or with a retry in flight"""
+        return len(self.attempts)
+
+    def close(self):
+        """No fresh ids are coming, due() ends once every retry has succeeded or been dead-lettered"""
+        self.closed = True
+        self._changed.set()
+
+    async def due(self):
+        """Yield ids as their next attempt comes due"""
+        while True:
+            self._changed.clear()
+            if self.heap and self.heap[0][0] <= time.monotonic():
+                yield heapq.heappop(self.heap)[1]
+                continue
+            if self.closed and not self.attempts:
+                return
+            timeout = self.heap[0][0] - time.monotonic() if self.heap else None
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
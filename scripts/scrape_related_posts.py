@@ -1,70 +1,82 @@
+import argparse
 import asyncio
 import os
 
-from douyin_scraper.douyin.web.web_crawler import DouyinWebCrawler
 import polars as pl
 from tqdm import tqdm
 
+from corpus import CorpusWriter, VideoCorpus
+from graph_crawl import RelatedGraphCrawler
+from keyword_tags import KeywordTagger
+from part_store import scan_dataset
+from proxy_pool import PROXIES_PATH, PooledDouyinCrawler, ProxyPool, load_proxies
+from user_timelines import LEGACY_USER_POSTS_PATHS, USER_POSTS_PATH
+
 async def main():
-    related_path = './data/douyin_related_videos.parquet.zstd'
-    if os.path.exists(related_path):
-        video_df = pl.read_parquet(related_path)
-    
-    user_posts_path = './data/douyin_videos.parquet.zstd'
-    if os.path.exists(user_posts_path):
-        user_video_df = pl.read_parquet(user_posts_path)
-        video_df = pl.concat([user_video_df, video_df], how='diagonal_relaxed').unique(subset=['aweme_id'])
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=['sample', 'graph'], default='sample',
+                        help="one hop from sampled seeds, or a breadth-first crawl of the related-videos graph")
+    parser.add_argument('--depth', type=int, default=2, help="graph mode: hops from the seeds")
+    parser.add_argument('--fan-out', type=int, default=10, help="graph mode: related videos expanded per node")
+    parser.add_argument('--workers', type=int, default=8, help="graph mode: concurrent requests")
+    parser.add_argument('--proxies', default=PROXIES_PATH, help="file with one proxy url per line to spread requests over")
+    args = parser.parse_args()
+
+    tagger = KeywordTagger('./data/keywords.txt')
+    corpus = VideoCorpus(tagger=tagger)
 
-    with open('./data/keywords.txt', 'r') as f:
-        keywords_lines = f.readlines()
+    # scrape_users.py adds new timeline videos to the corpus as it stores them, ones stored before
+    # it did are found by an anti-join on the id columns, so only those are ever loaded
+    user_posts_path = next((path for path in (USER_POSTS_PATH,) + LEGACY_USER_POSTS_PATHS if os.path.exists(path)), None)
+    if user_posts_path is not None:
+        user_videos = scan_dataset(user_posts_path).with_columns(pl.col('aweme_id').cast(pl.String))
+        if corpus.store.parts():
+            user_videos = user_videos.join(corpus.scan(columns=['aweme_id']), on='aweme_id', how='anti')
+        corpus.upsert(user_videos.collect().to_dicts(), source='user_posts')
 
-    all_keywords = []
-    for line in keywords_lines:
-        keywords, explanation = line.split('(')
-        keywords = keywords.split('or')
-        keywords = [k.strip() for k in keywords]
-        all_keywords.extend(keywords)
+    # only videos without tags for this keywords.txt are matched, i.e. new ones or all after an edit
+    num_tagged = tagger.sync(corpus)
+    if num_tagged:
+        print(f"Tagged {num_tagged} videos with {len(tagger.keywords)} keywords.")
+    video_df = tagger.scan().unique(subset=['aweme_id']).collect()
 
     print(f"Starting with {video_df.shape[0]} videos.")
 
-    interesting_sample_df = video_df.filter(pl.col('desc').str.contains_any(all_keywords)).sample(400)
-    general_sample_df = video_df.filter(~pl.col('desc').str.contains_any(all_keywords)).sample(100)
+    interesting_sample_df = video_df.filter(pl.col('has_keyword')).sample(400)
+    general_sample_df = video_df.filter(~pl.col('has_keyword')).sample(100)
     sample_df = pl.concat([interesting_sample_df, general_sample_df], how='diagonal_relaxed')
 
-    crawler = DouyinWebCrawler()
+    pool = ProxyPool(load_proxies(args.proxies), connections_per_proxy=args.workers)
+    await pool.open()
+    crawler = PooledDouyinCrawler(pool)
 
-    all_results = []
-    for video in tqdm(sample_df.to_dicts()):
-        video_id = video['aweme_id']
+    if args.mode == 'graph':
+        graph_crawler = RelatedGraphCrawler(crawler, corpus, max_depth=args.depth, fan_out=args.fan_out, num_workers=args.workers)
+        pbar = tqdm()
         try:
-            result = await crawler.fetch_related_videos(video_id)
-            all_results.extend(result['aweme_list'])
-        except Exception as e:
-            print(f"Error fetching related videos for {video_id}: {e}")
-
-    schema_overrides = {
-        'duet_origin_item': pl.Struct({
-            'feed_comment_config': pl.Struct({'dummy': pl.Null}),
-            'show_follow_button': pl.Struct({'dummy': pl.Null}),
-            'poi_biz': pl.Struct({'dummy': pl.Null}),
-        })
-    }
-
-    df = pl.concat([video_df, pl.from_dicts(all_results, infer_schema_length=len(all_results))], how='diagonal_relaxed')\
-        .unique(subset=['aweme_id'])
-    
-    print(f"Total videos after merging: {df.shape[0]}")
-        
-    if 'duet_origin_item' in df.columns:
-        df = df.drop('duet_origin_item')
-
-    if 'show_follow_button' in df.columns:
-        df = df.drop('show_follow_button')
+            await graph_crawler.run(sample_df['aweme_id'].to_list(), pbar=pbar)
+        finally:
+            pbar.close()
+            corpus.close()
+            await pool.close()
+        return
 
-    if 'entertainment_product_info' in df.columns:
-        df = df.drop('entertainment_product_info')
+    num_new = 0
+    corpus_writer = CorpusWriter(corpus).start()
+    try:
+        for video in tqdm(sample_df.to_dicts()):
+            video_id = video['aweme_id']
+            try:
+                result = await crawler.fetch_related_videos(video_id)
+                num_new += await corpus_writer.upsert(result['aweme_list'], source=video_id)
+            except Exception as e:
+                print(f"Error fetching related videos for {video_id}: {e}")
+    finally:
+        await corpus_writer.close()
+        corpus.close()
+        await pool.close()
 
-    df.write_parquet(related_path, compression='zstd')
+    print(f"Total videos after merging: {video_df.shape[0] + num_new}")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -1,49 +1,45 @@
+import argparse
 import asyncio
-import os
 
-from douyin_scraper.douyin.web.web_crawler import DouyinWebCrawler
-import polars as pl
+from tqdm import tqdm
 
-async def main():
-    video_path = 'douyin_videos.parquet.zstd'
-    if os.path.exists(video_path):
-        video_df = pl.read_parquet(video_path)
-    else:
-        video_df = pl.DataFrame()
+from corpus import VideoCorpus
+from proxy_pool import PROXIES_PATH, PooledDouyinCrawler, ProxyPool, load_proxies
+from user_timelines import UserTimelineCrawler
 
-    sec_uids = [
-        'MS4wLjABAAAALBQu0odP0MyyGWgDpnvBTsSLhorbHcYxES8uubAVDEitEw3liy-Ytsk6tr_JKgN9',
-        'MS4wLjABAAAA4W5VX_Uamm8KpIhzBgZsfEi8rxCqK0L5Ph1T_RuBiwm9UnH7NJkTRRlJ_9EaM0GK',
-        'MS4wLjABAAAA4vgRHGrSG6rPlffm3RvwHWL8TBq7O4YnM5jHUNXz0-s',
-        'MS4wLjABAAAA-q30KOkHxTIpaBibao2fuoPgI7vRE1e4V2ySmJibmTyuR65lCCJM3lNNzAyZMrAs',
-        'MS4wLjABAAAAJUrMay85Tgu4Fapq4E4jWP0EhmC16Jn4W1nZ5xEZE3Q',
-        'MS4wLjABAAAA8B8Rkt2KE1obYtNeSdY7KAQXGgsRNIRDB5mlvhj-WxY'
-    ]
+SEC_UIDS = [
+    'MS4wLjABAAAALBQu0odP0MyyGWgDpnvBTsSLhorbHcYxES8uubAVDEitEw3liy-Ytsk6tr_JKgN9',
+    'MS4wLjABAAAA4W5VX_Uamm8KpIhzBgZsfEi8rxCqK0L5Ph1T_RuBiwm9UnH7NJkTRRlJ_9EaM0GK',
+    'MS4wLjABAAAA4vgRHGrSG6rPlffm3RvwHWL8TBq7O4YnM5jHUNXz0-s',
+    'MS4wLjABAAAA-q30KOkHxTIpaBibao2fuoPgI7vRE1e4V2ySmJibmTyuR65lCCJM3lNNzAyZMrAs',
+    'MS4wLjABAAAAJUrMay85Tgu4Fapq4E4jWP0EhmC16Jn4W1nZ5xEZE3Q',
+    'MS4wLjABAAAA8B8Rkt2KE1obYtNeSdY7KAQXGgsRNIRDB5mlvhj-WxY'
+]
 
-    crawler = DouyinWebCrawler()
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', help="file with one sec_uid per line, defaults to the built-in list")
+    parser.add_argument('--refresh', action='store_true', help="only fetch posts newer than the ones already stored")
+    parser.add_argument('--concurrency', type=int, default=8, help="users paged at the same time")
+    parser.add_argument('--proxies', default=PROXIES_PATH, help="file with one proxy url per line to spread requests over")
+    args = parser.parse_args()
 
-    all_results = []
-    for sec_uid in sec_uids:
-        has_more = True
-        cursor = 0
-        while has_more:
-            results = await crawler.fetch_user_post_videos(sec_uid, cursor, 20)
-            if 'aweme_list' not in results:
-                break
-            all_results.extend(results['aweme_list'])
-            has_more = bool(results.get('has_more', False))
-            # cursor = results.get('max_cursor', 0)
-            cursor += 20
+    sec_uids = SEC_UIDS
+    if args.users:
+        with open(args.users, 'r') as f:
+            sec_uids = [line.strip() for line in f if line.strip()]
 
-    schema_overrides = {
-        'show_follow_button': pl.Struct({'dummy': pl.Null}),
-        'video_game_data_channel_config': pl.Struct({'dummy': pl.Null}),
-        'image_comment': pl.Struct({'dummy': pl.Null}),
-        'series_basic_info': pl.Struct({'dummy': pl.Null}),
-    }
-    pl.concat([video_df, pl.from_dicts(all_results, infer_schema_length=len(all_results), schema_overrides=schema_overrides)], how='diagonal_relaxed')\
-        .unique(subset=['aweme_id'])\
-        .write_parquet(video_path, compression='zstd')
+    pbar = tqdm(desc='pages')
+    # new posts go straight into the corpus too
+    corpus = VideoCorpus()
+    async with ProxyPool(load_proxies(args.proxies), connections_per_proxy=args.concurrency) as pool:
+        timelines = UserTimelineCrawler(PooledDouyinCrawler(pool), concurrency=args.concurrency, corpus=corpus)
+        try:
+            num_new = await timelines.run(sec_uids, refresh=args.refresh, pbar=pbar)
+        finally:
+            pbar.close()
+            corpus.close()
+    print(f"Stored {num_new} new posts from {len(sec_uids)} users.")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,181 @@
+import json
+import os
+
+import numpy as np
+import polars as pl
+
+from aweme_ids import MILLISECOND_BITS, MILLISECOND_MASK, MILLISECOND_SHIFT, SECTION_MASK, TIMESTAMP_SHIFT
+
+SECONDS_PER_HOUR = 3600
+NO_SECONDS = np.iinfo(np.int64).max
+
+
+class SectionCatalog:
+    """Persistent per-section counts and time coverage of the ids in a dataset.
+
+    For every section seen it keeps the number of ids and the first and last second they were
+    created in, plus hour of day and millisecond histograms over all ids, in one small
+    snapshot that loads in milliseconds whatever the size of the dataset. Ids added since the
+    snapshot are appended to a journal that belongs to it and are folded in on checkpoint(),
+    so the catalog is updated as new data lands instead of being recomputed from the dataset.
+    """
+    def __init__(self, path, checkpoint_every=1_000_000):
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.current_path = os.path.join(path, 'current.json')
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _snapshot_path(self, generation=None):
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.path, f"catalog-{generation:06d}.npz")
+
+    def _journal_path(self, generation=None):
+        # counts are not idempotent, so a journal is only ever replayed onto the snapshot it follows
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.path, f"journal-{generation:06d}.bin")
+
+    def _load(self):
+        self.generation = 0
+        self.sections = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.first_seconds = np.empty(0, dtype=np.int64)
+        self.last_seconds = np.empty(0, dtype=np.int64)
+        self.hours = np.zeros(24, dtype=np.int64)
+        self.milliseconds = np.zeros(1 << MILLISECOND_BITS, dtype=np.int64)
+        if os.path.exists(self.current_path):
+            with open(self.current_path, 'r') as f:
+                self.generation = json.load(f)['generation']
+            with np.load(self._snapshot_path()) as data:
+                for name in ('sections', 'counts', 'first_seconds', 'last_seconds', 'hours', 'milliseconds'):
+                    setattr(self, name, data[name])
+
+        self.pending = []
+        self.journal_size = 0
+        if os.path.exists(self._journal_path()):
+            ids = np.fromfile(self._journal_path(), dtype='<u8')
+            self.pending.append(ids)
+            self.journal_size = len(ids)
+
+    def add(self, aweme_ids):
+        """Count newly stored ids, each id should be added once, durable once this returns"""
+        ids = np.fromiter((int(i) for i in aweme_ids), dtype=np.uint64)
+        if len(ids) == 0:
+            return
+        with open(self._journal_path(), 'ab') as f:
+            ids.astype('<u8').tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending.append(ids)
+        self.journal_size += len(ids)
+        if self.journal_size >= self.checkpoint_every:
+            self.checkpoint()
+
+    def _fold(self):
+        if not self.pending:
+            return
+        ids = np.concatenate(self.pending)
+        self.pending = []
+        seconds = (ids >> np.uint64(TIMESTAMP_SHIFT)).astype(np.int64)
+        self.hours = self.hours + np.bincount((seconds // SECONDS_PER_HOUR) % 24, minlength=24)
+        milliseconds = ((ids >> np.uint64(MILLISECOND_SHIFT)) & np.uint64(MILLISECOND_MASK)).astype(np.intp)
+        self.milliseconds = self.milliseconds + np.bincount(milliseconds, minlength=len(self.milliseconds))
+
+        sections = (ids & np.uint64(SECTION_MASK)).astype(np.int64)
+        order = np.argsort(sections, kind='stable')
+        sections, seconds = sections[order], seconds[order]
+        new_sections, starts, new_counts = np.unique(sections, return_index=True, return_counts=True)
+
+        merged, inverse = np.unique(np.concatenate([self.sections, new_sections]), return_inverse=True)
+        old, new = inverse[:len(self.sections)], inverse[len(self.sections):]
+        counts = np.zeros(len(merged), dtype=np.int64)
+        first_seconds = np.full(len(merged), NO_SECONDS, dtype=np.int64)
+        last_seconds = np.zeros(len(merged), dtype=np.int64)
+        # both sides hold unique sections, so plain fancy indexing never collides
+        counts[old] = self.counts
+        first_seconds[old] = self.first_seconds
+        last_seconds[old] = self.last_seconds
+        counts[new] += new_counts
+        first_seconds[new] = np.minimum(first_seconds[new], np.minimum.reduceat(seconds, starts))
+        last_seconds[new] = np.maximum(last_seconds[new], np.maximum.reduceat(seconds, starts))
+        self.sections, self.counts = merged, counts
+        self.first_seconds, self.last_seconds = first_seconds, last_seconds
+
+    def section_counts(self):
+        """Number of ids and first and last second covered per section, most common first"""
+        self._fold()
+        return pl.DataFrame({
+            'section': self.sections,
+            'count': self.counts,
+            'first_seconds': self.first_seconds,
+            'last_seconds': self.last_seconds,
+        }).sort(['count', 'section'], descending=[True, False])
+
+    def most_common(self, n=1):
+        self._fold()
+        order = np.lexsort((self.sections, -self.counts))[:n]
+        return self.sections[order].tolist()
+
+    def coverage(self, section):
+        """(first, last) creation second of the ids in section, None if it has none"""
+        self._fold()
+        i = np.searchsorted(self.sections, section)
+        if i == len(self.sections) or self.sections[i] != section:
+            return None
+        return int(self.first_seconds[i]), int(self.last_seconds[i])
+
+    def histograms(self):
+        """Hour of day and millisecond slot histograms over all ids"""
+        self._fold()
+        return {'hour': self.hours, 'millisecond': self.milliseconds}
+
+    def total(self):
+        self._fold()
+        return int(self.counts.sum())
+
+    def is_empty(self):
+        return len(self.sections) == 0 and not self.pending
+
+    def checkpoint(self):
+        """Fold the journal into a new snapshot and start a new journal"""
+        if not self.pending and not os.path.exists(self._journal_path()):
+            return
+        self._fold()
+        generation = self.generation + 1
+        tmp_path = self._snapshot_path(generation) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f, sections=self.sections, counts=self.counts, first_seconds=self.first_seconds,
+                last_seconds=self.last_seconds, hours=self.hours, milliseconds=self.milliseconds,
+            )
+        os.replace(tmp_path, self._snapshot_path(generation))
+
+        tmp_path = self.current_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'generation': generation}, f)
+        os.replace(tmp_path, self.current_path)
+
+        old_generation = self.generation
+        self.generation = generation
+        self.journal_size = 0
+        for path in (self._snapshot_path(old_generation), self._journal_path(old_generation)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def build(self, aweme_ids):
+        """Bulk load the ids of an existing dataset, e.g. on first use"""
+        self.pending.append(np.asarray(aweme_ids, dtype=np.uint64))
+        self.checkpoint()
+
+
+def load_section_catalog(path, store=None):
+    """Open the catalog at path, counting the ids in a store the first time"""
+    catalog = SectionCatalog(path)
+    if catalog.is_empty() and store is not None and store.parts():
+        ids = store.scan(columns=['aweme_id'])\
+            .select(pl.col('aweme_id').cast(pl.UInt64))\
+            .drop_nulls()\
+            .unique()\
+            .collect()['aweme_id'].to_numpy()
+        catalog.build(ids)
+    return catalog
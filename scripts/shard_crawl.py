@@ -0,0 +1,112 @@
+import argparse
+import asyncio
+import datetime
+import multiprocessing
+import os
+import socket
+
+from tqdm import tqdm
+
+from aweme_ids import section_counts
+from corpus import CORPUS_PATH, VideoCorpus
+from part_store import PartStore, scan_dataset
+from shards import ShardCoordinator, crawl_shards, verify_coverage
+
+
+async def fetch_dry_run(aweme_id):
+    # local stand-in that answers instantly, used to check shard coverage without network traffic
+    await asyncio.sleep(0)
+    return {'status_code': 0, 'aweme_detail': None}
+
+
+async def run_worker(args, owner):
+    coordinator = ShardCoordinator(args.db, lease_seconds=args.lease_seconds)
+    store = PartStore(args.store)
+    pbar = tqdm(desc=owner, position=args.worker_index) if not args.dry_run else None
+    try:
+        if args.dry_run:
+            await crawl_shards(coordinator, owner, fetch_dry_run, store,
+                               concurrency=args.concurrency, milliseconds=args.milliseconds,
+                               max_attempts=args.max_attempts, pbar=pbar)
+        elif args.mode == 'detail':
+            from fetch_engine import PostDetailEngine
+            from proxy_pool import load_proxies
+            async with PostDetailEngine(concurrency=args.concurrency, proxies=load_proxies(args.proxies)) as engine:
+                await crawl_shards(coordinator, owner, engine.fetch, store,
+                                   concurrency=args.concurrency, milliseconds=args.milliseconds,
+                                   max_attempts=args.max_attempts, pbar=pbar)
+        else:
+            from proxy_pool import PooledDouyinCrawler, ProxyPool, load_proxies
+            async with ProxyPool(load_proxies(args.proxies), connections_per_proxy=args.concurrency) as pool:
+                crawler = PooledDouyinCrawler(pool)
+                await crawl_shards(coordinator, owner, crawler.fetch_related_videos, store,
+                                   concurrency=args.concurrency, milliseconds=args.milliseconds,
+                                   max_attempts=args.max_attempts, pbar=pbar)
+    finally:
+        if pbar is not None:
+            pbar.close()
+        coordinator.close()
+
+
+def worker_main(args, worker_index):
+    args.worker_index = worker_index
+    owner = f"{socket.gethostname()}-{os.getpid()}"
+    asyncio.run(run_worker(args, owner))
+
+
+def parse_time(value):
+    return int(datetime.datetime.fromisoformat(value).timestamp())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enumerate the aweme_id space in leased (time range x section) shards")
+    parser.add_argument('--db', default='./data/shards.sqlite')
+    parser.add_argument('--store', default='./data/douyin_sharded_videos')
+    parser.add_argument('--mode', choices=['detail', 'related'], default='detail')
+    parser.add_argument('--start', type=parse_time, help="ISO start time, only needed to plan new shards")
+    parser.add_argument('--end', type=parse_time, help="ISO end time, only needed to plan new shards")
+    parser.add_argument('--top-sections', type=int, default=0, help="plan only the N most common sections, 0 for all")
+    parser.add_argument('--sections-from', default=CORPUS_PATH, help="parquet file or part store of known ids")
+    parser.add_argument('--shard-seconds', type=int, default=3600)
+    parser.add_argument('--lease-seconds', type=int, default=300)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--concurrency', type=int, default=16, help="in-flight requests per process")
+    parser.add_argument('--proxies', default='./data/proxies.txt', help="file with one proxy url per line to spread requests over")
+    parser.add_argument('--milliseconds', type=int, default=1000, help="millisecond slots probed per second")
+    parser.add_argument('--max-attempts', type=int, default=5, help="attempts per id before it is dead-lettered and its shard left with gaps")
+    parser.add_argument('--dry-run', action='store_true', help="probe a local stand-in instead of Douyin and verify coverage")
+    args = parser.parse_args()
+
+    if args.start is not None and args.end is not None:
+        if args.sections_from == CORPUS_PATH:
+            # the corpus keeps its section counts up to date, no need to read every id
+            counts = VideoCorpus().catalog.section_counts()
+        else:
+            counts = section_counts(scan_dataset(args.sections_from, columns=['aweme_id'])).collect()
+        if args.top_sections:
+            counts = counts.head(args.top_sections)
+        coordinator = ShardCoordinator(args.db, lease_seconds=args.lease_seconds)
+        coordinator.plan(counts['section'].to_list(), args.start, args.end, shard_seconds=args.shard_seconds)
+        coordinator.close()
+
+    # polars' thread pool is not fork safe
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=worker_main, args=(args, i))
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    coordinator = ShardCoordinator(args.db)
+    print(f"Shards: {coordinator.progress()}")
+    if args.dry_run:
+        duplicates, missing = verify_coverage(coordinator, PartStore(args.store), milliseconds=args.milliseconds)
+        print(f"Duplicate ids: {duplicates}, missing ids: {missing}")
+    coordinator.close()
+
+
+if __name__ == "__main__":
+    main()
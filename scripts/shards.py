@@ -0,0 +1,268 @@
+import asyncio
+import contextlib
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from aweme_ids import encode_aweme_id
+from probe_index import ProbeOutcomes
+from probe_ledger import ProbeLedger
+from raw_segments import flatten_response
+from retries import DeadLetters, RetryScheduler
+
+
+@dataclass
+class Shard:
+    shard_id: int
+    section: int
+    start: int
+    end: int
+    cursor: int
+
+
+class ShardCoordinator:
+    """SQLite backed work claims over the (time range x section) id space.
+
+    Each shard covers [start, end) seconds of one section. Workers claim a shard with a lease,
+    advance its cursor as results are committed and mark it done, or 'gaps' if some of its ids
+    failed every retry. Shards whose lease expired are handed out again and resume from the last
+    committed cursor.
+    """
+    def __init__(self, db_path, lease_seconds=300):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS shards (
+                shard_id INTEGER PRIMARY KEY,
+                section INTEGER NOT NULL,
+                start INTEGER NOT NULL,
+                end INTEGER NOT NULL,
+                cursor INTEGER NOT NULL,
+                priority INTEGER NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                owner TEXT,
+                lease_expires REAL,
+                claims INTEGER NOT NULL DEFAULT 0,
+                gaps INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (section, start)
+            )
+        """)
+        with self._transaction():
+            columns = [row[1] for row in self.conn.execute('PRAGMA table_info(shards)')]
+            if 'gaps' not in columns:
+                # planned before dead-lettered ids were counted
+                self.conn.execute('ALTER TABLE shards ADD COLUMN gaps INTEGER NOT NULL DEFAULT 0')
+
+    def close(self):
+        self.conn.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front so two workers can never claim the same shard
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        else:
+            self.conn.execute('COMMIT')
+
+    def plan(self, sections, start, end, shard_seconds=3600):
+        """Create shards for every section over [start, end), sections earlier in the list are claimed first"""
+        rows = [
+            (section, shard_start, min(shard_start + shard_seconds, end), shard_start, priority)
+            for priority, section in enumerate(sections)
+            for shard_start in range(start, end, shard_seconds)
+        ]
+        with self._transaction():
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO shards (section, start, end, cursor, priority) VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+
+    def claim(self, owner):
+        """Lease the next pending or expired shard to owner, None when everything is done or leased"""
+        now = time.time()
+        with self._transaction():
+            row = self.conn.execute("""
+                SELECT shard_id, section, start, end, cursor FROM shards
+                WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?)
+                ORDER BY priority, start
+                LIMIT 1
+            """, (now,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("""
+                UPDATE shards SET state = 'leased', owner = ?, lease_expires = ?, claims = claims + 1
+                WHERE shard_id = ?
+            """, (owner, now + self.lease_seconds, row[0]))
+        return Shard(*row)
+
+    def renew(self, shard, owner):
+        """Extend the lease, False if it was lost to another worker"""
+        with self._transaction():
+            updated = self.conn.execute("""
+                UPDATE shards SET lease_expires = ?
+                WHERE shard_id = ? AND owner = ? AND state = 'leased'
+            """, (time.time() + self.lease_seconds, shard.shard_id, owner)).rowcount
+        return updated == 1
+
+    def advance(self, shard, owner, cursor, gaps=0):
+        """Commit progress up to cursor, with `gaps` ids that failed every retry, and renew the lease, False if the lease was lost"""
+        with self._transaction():
+            updated = self.conn.execute("""
+                UPDATE shards SET cursor = ?, gaps = gaps + ?, lease_expires = ?
+                WHERE shard_id = ? AND owner = ? AND state = 'leased'
+            """, (cursor, gaps, time.time() + self.lease_seconds, shard.shard_id, owner)).rowcount
+        shard.cursor = cursor
+        return updated == 1
+
+    def complete(self, shard, owner):
+        with self._transaction():
+            updated = self.conn.execute("""
+                UPDATE shards SET state = CASE WHEN gaps > 0 THEN 'gaps' ELSE 'done' END,
+                    cursor = end, owner = NULL, lease_expires = NULL
+                WHERE shard_id = ? AND owner = ? AND state = 'leased'
+            """, (shard.shard_id, owner)).rowcount
+        return updated == 1
+
+    def progress(self):
+        return dict(self.conn.execute('SELECT state, COUNT(*) FROM shards GROUP BY state').fetchall())
+
+    def done_shards(self):
+        return [
+            Shard(*row) for row in
+            self.conn.execute("SELECT shard_id, section, start, end, cursor FROM shards WHERE state = 'done'")
+        ]
+
+
+def outcomes_path(store):
+    """Probe outcomes of a sharded crawl, one ProbeOutcomes per worker as its bitmaps are not shared between processes"""
+    return store.path + '_outcomes'
+
+
+async def crawl_shards(coordinator, owner, fetch, store, concurrency=16, batch_size=1000, milliseconds=1000,
+                       max_attempts=5, pbar=None):
+    """Claim shards until none are left, probing every id in each with `fetch` and appending the hits to store.
+
+    A failed or empty (throttled) probe is retried with backoff within its batch, so a batch is
+    only committed once each of its ids was answered or dead-lettered. Hits are written to
+    store, hits and misses are recorded in this worker's ProbeOutcomes and dead-lettered ids
+    are counted as gaps of their shard, which is then left in the 'gaps' state instead of done.
+
+    Results are committed before the shard cursor moves past them, so a worker that dies loses
+    no ids; whoever reclaims the shard re-probes at most one uncommitted batch. The lease is
+    renewed right before every commit and a batch is dropped once the lease is lost, so a worker
+    that outlived its lease never writes ids its successor probes again.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    outcomes = ProbeOutcomes(os.path.join(outcomes_path(store), owner))
+    dead_letters = DeadLetters(store.path + '_dead_letters')
+    seconds_per_batch = max(1, batch_size // milliseconds)
+
+    async def crawl_batch(shard, aweme_ids):
+        """Probe and commit aweme_ids, returns how many were dead-lettered or None if the lease was lost"""
+        # the retries of a batch have to fit in the lease, which is only renewed by a commit
+        retries = RetryScheduler(dead_letters, max_attempts=max_attempts, max_delay=coordinator.lease_seconds / 4)
+        abandoned = []
+        ledger = ProbeLedger(outcomes=outcomes, retries=retries, on_abandon=abandoned.append)
+        statuses = []
+        hits = []
+
+        async def probe(aweme_id):
+            async with semaphore:
+                try:
+                    response = await fetch(aweme_id)
+                except Exception as e:
+                    print(f"{owner} - Error fetching data for video ID {aweme_id}: {e}")
+                    ledger.failed(aweme_id, 'error', repr(e))
+                    return
+                finally:
+                    if pbar is not None:
+                        pbar.update(1)
+            if not response or ('aweme_detail' not in response and 'aweme_list' not in response):
+                # throttled, worth another try
+                ledger.failed(aweme_id, 'empty')
+                return
+            ledger.succeeded(aweme_id)
+            response = flatten_response(response)
+            if response.get('aweme_detail') or response.get('aweme_list'):
+                statuses.append((aweme_id, 'hit'))
+                hits.append({'aweme_id': aweme_id, 'result': response})
+            else:
+                statuses.append((aweme_id, 'miss'))
+
+        async def retry_worker():
+            async for aweme_id in retries.due():
+                await probe(aweme_id)
+
+        retry_workers = [asyncio.create_task(retry_worker()) for _ in range(max(1, concurrency // 4))]
+        try:
+            await asyncio.gather(*(probe(aweme_id) for aweme_id in aweme_ids))
+            retries.close()
+            await asyncio.gather(*retry_workers)
+        finally:
+            for task in retry_workers:
+                task.cancel()
+            await asyncio.gather(*retry_workers, return_exceptions=True)
+
+        # a worker whose lease expired, e.g. while stalled on slow requests, may have lost the shard
+        # to another one probing the same ids, so its results are only written with a fresh lease
+        if not coordinator.renew(shard, owner):
+            print(f"{owner} - Lost the lease of shard {shard.shard_id}, dropping {len(statuses)} results")
+            return None
+        store.append_records(hits)
+        ledger.written(statuses)
+        return len(abandoned)
+
+    try:
+        while (shard := coordinator.claim(owner)) is not None:
+            for batch_start in range(shard.cursor, shard.end, seconds_per_batch):
+                batch_end = min(batch_start + seconds_per_batch, shard.end)
+                aweme_ids = [
+                    encode_aweme_id(seconds, ms, shard.section)
+                    for seconds in range(batch_start, batch_end) for ms in range(milliseconds)
+                ]
+                gaps = await crawl_batch(shard, aweme_ids)
+                if gaps is None or not coordinator.advance(shard, owner, batch_end, gaps):
+                    break
+            else:
+                coordinator.complete(shard, owner)
+    finally:
+        outcomes.checkpoint()
+        dead_letters.close()
+
+
+def verify_coverage(coordinator, store, milliseconds=1000):
+    """Check the outcomes of all done shards, returns (duplicate, missing) counts.
+
+    An id is missing if no worker recorded it as a hit or miss and a duplicate if more than one
+    did, or if store holds it more than once.
+    """
+    shards = coordinator.done_shards()
+    path = outcomes_path(store)
+    if not shards or not os.path.isdir(path):
+        return 0, sum((shard.end - shard.start) * milliseconds for shard in shards)
+    workers = [ProbeOutcomes(os.path.join(path, owner)) for owner in sorted(os.listdir(path))]
+    duplicates = 0
+    missing = 0
+    for shard in shards:
+        for seconds in range(shard.start, shard.end):
+            answered = np.zeros(milliseconds, dtype=np.int64)
+            for outcomes in workers:
+                answered += (
+                    outcomes.indexes['hit'].probed_milliseconds(seconds, shard.section)
+                    | outcomes.indexes['miss'].probed_milliseconds(seconds, shard.section)
+                )[:milliseconds]
+            duplicates += int((answered > 1).sum())
+            missing += int((answered == 0).sum())
+    if store.parts():
+        ids = store.scan(columns=['aweme_id']).collect()
+        duplicates += ids.height - ids.unique().height
+    return duplicates, missing
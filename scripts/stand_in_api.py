@@ -0,0 +1,258 @@
+import json
+import multiprocessing
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from raw_segments import read_segment, sealed_segments
+
+DOUYIN_DOMAIN = 'https://www.douyin.com'
+
+
+def synthetic_aweme(aweme_id, create_time=None, rng=None):
+    """A post with the fields the projections and corpus read, values are made up"""
+    rng = rng or random.Random(aweme_id)
+    create_time = create_time or int(aweme_id) >> 32
+    author_id = rng.randrange(10 ** 9)
+    return {
+        'aweme_id': str(aweme_id),
+        'desc': rng.choice(['日常', '美食 分享', '旅行 vlog', '猫 和 狗', 'news']),
+        'create_time': create_time,
+        'author': {'uid': str(author_id), 'sec_uid': f"MS4wLjABAAAA{author_id}", 'nickname': f"user{author_id}"},
+        'music': {'id_str': str(rng.randrange(10 ** 9)), 'title': 'original sound'},
+        'duration': rng.randrange(5000, 120000),
+        'statistics': {
+            'play_count': rng.randrange(10 ** 6),
+            'digg_count': rng.randrange(10 ** 5),
+            'comment_count': rng.randrange(10 ** 4),
+            'share_count': rng.randrange(10 ** 4),
+            'collect_count': rng.randrange(10 ** 4),
+        },
+        'is_top': 0,
+    }
+
+
+class Fixtures:
+    """Responses for the stand-in server, replayed from raw segments where recorded, synthesized otherwise.
+
+    Synthetic responses are a deterministic function of the request, so repeated runs against
+    the same settings see the same hits, related lists and timelines.
+    """
+    def __init__(self, segments_path=None, hit_rate=0.05, related_count=10, posts_per_user=100):
+        self.hit_rate = hit_rate
+        self.related_count = related_count
+        self.posts_per_user = posts_per_user
+        self.details = {}
+        self.related_lists = {}
+        if segments_path:
+            for segment_path in sealed_segments(segments_path):
+                for record in read_segment(segment_path):
+                    result = record.get('result') or {}
+                    if 'aweme_detail' in result:
+                        self.details[record['aweme_id']] = result
+                    elif 'aweme_list' in result:
+                        self.related_lists[record['aweme_id']] = result
+
+    def detail(self, aweme_id):
+        if aweme_id in self.details:
+            return self.details[aweme_id]
+        rng = random.Random(aweme_id)
+        if rng.random() >= self.hit_rate:
+            return {'status_code': 0, 'aweme_detail': None}
+        return {'status_code': 0, 'aweme_detail': synthetic_aweme(aweme_id, rng=rng)}
+
+    def related(self, aweme_id):
+        if aweme_id in self.related_lists:
+            return self.related_lists[aweme_id]
+        rng = random.Random(aweme_id)
+        # related videos are close to the source in time, so their ids are valid aweme_ids too
+        seconds = int(aweme_id) >> 32
+        related_ids = [
+            ((seconds - rng.randrange(86400 * 30)) << 32) | rng.randrange(1 << 32)
+            for _ in range(self.related_count)
+        ]
+        return {'status_code': 0, 'aweme_list': [synthetic_aweme(related_id, rng=rng) for related_id in related_ids]}
+
+    def user_posts(self, sec_uid, max_cursor, count):
+        """One page of a timeline, max_cursor is the create time in ms of the last post returned"""
+        rng = random.Random(sec_uid)
+        newest = int(time.time()) - rng.randrange(86400)
+        user_bits = rng.randrange(1 << 32)
+        create_times = [newest - i * 3600 for i in range(self.posts_per_user)]
+        if max_cursor:
+            create_times = [create_time for create_time in create_times if create_time * 1000 < max_cursor]
+        page = create_times[:count]
+        return {
+            'status_code': 0,
+            'aweme_list': [synthetic_aweme((create_time << 32) | user_bits, create_time=create_time) for create_time in page],
+            'has_more': int(len(create_times) > count),
+            'max_cursor': page[-1] * 1000 if page else 0,
+        }
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        # once per accepted connection, against requests it shows whether clients keep them alive
+        self.server.count('connections')
+
+    def send_json(self, status, body):
+        data = b'' if body is None else json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        # requests sent through a stand-in proxy carry the absolute url
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == '/_stats':
+            self.send_json(200, dict(server.stats))
+            return
+
+        if server.latency:
+            time.sleep(max(0.0, random.gauss(server.latency, server.jitter)))
+        server.count('requests')
+        if server.bucket is not None and not server.bucket.take():
+            # a throttled request comes back as a 200 without a body
+            server.count('throttled')
+            self.send_json(200, None)
+            return
+        if random.random() < server.error_rate:
+            server.count('errors')
+            self.send_json(500, {'status_code': 500})
+            return
+
+        if url.path.endswith('/aweme/detail/'):
+            body = server.fixtures.detail(params.get('aweme_id', '0'))
+        elif url.path.endswith('/aweme/related/'):
+            body = server.fixtures.related(params.get('aweme_id', '0'))
+        elif url.path.endswith('/aweme/post/'):
+            body = server.fixtures.user_posts(params.get('sec_uid', ''), int(params.get('max_cursor') or 0), int(params.get('count') or 20))
+        else:
+            server.count('not_found')
+            self.send_json(404, {'status_code': 404})
+            return
+        self.send_json(200, body)
+
+
+class StandInServer(ThreadingHTTPServer):
+    """Local replacement for the Douyin web API endpoints with injectable latency, errors and throttling"""
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address, fixtures, latency_ms=0, jitter_ms=0, error_rate=0.0, throttle_rps=None, name=None):
+        super().__init__(address, StandInHandler)
+        self.name = name
+        self.fixtures = fixtures
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.bucket = TokenBucket(throttle_rps) if throttle_rps else None
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+
+    def count(self, name):
+        with self.stats_lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+            # proxies share the stats of the server, with a per-proxy count of their own
+            if self.name is not None:
+                self.stats[f"{self.name}.{name}"] = self.stats.get(f"{self.name}.{name}", 0) + 1
+
+
+def _serve(port_queue, fixture_kwargs, server_kwargs, num_proxies):
+    fixtures = Fixtures(**fixture_kwargs)
+    server = StandInServer(('127.0.0.1', 0), fixtures, **server_kwargs)
+    # a stand-in proxy answers the requests sent through it itself, like the API seen from
+    # another egress ip: same responses, its own throttling
+    proxy_ports = []
+    for i in range(num_proxies):
+        proxy = StandInServer(('127.0.0.1', 0), fixtures, name=f"proxy{i}", **server_kwargs)
+        proxy.stats, proxy.stats_lock = server.stats, server.stats_lock
+        threading.Thread(target=proxy.serve_forever, daemon=True).start()
+        proxy_ports.append(proxy.server_address[1])
+    port_queue.put((server.server_address[1], proxy_ports))
+    server.serve_forever()
+
+
+class StandInProcess:
+    """Runs the stand-in server in its own process so it does not compete with the client for the GIL.
+
+    With `num_proxies`, the process also serves that many stand-in proxies, listed in proxy_urls.
+    """
+    def __init__(self, segments_path=None, hit_rate=0.05, related_count=10, posts_per_user=100,
+                 latency_ms=0, jitter_ms=0, error_rate=0.0, throttle_rps=None, num_proxies=0):
+        self.fixture_kwargs = {
+            'segments_path': segments_path, 'hit_rate': hit_rate,
+            'related_count': related_count, 'posts_per_user': posts_per_user,
+        }
+        self.server_kwargs = {
+            'latency_ms': latency_ms, 'jitter_ms': jitter_ms,
+            'error_rate': error_rate, 'throttle_rps': throttle_rps,
+        }
+        self.num_proxies = num_proxies
+        self.process = None
+        self.base_url = None
+        self.proxy_urls = []
+
+    def __enter__(self):
+        context = multiprocessing.get_context('spawn')
+        port_queue = context.Queue()
+        args = (port_queue, self.fixture_kwargs, self.server_kwargs, self.num_proxies)
+        self.process = context.Process(target=_serve, args=args, daemon=True)
+        self.process.start()
+        port, proxy_ports = port_queue.get(timeout=30)
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.proxy_urls = [f"http://127.0.0.1:{proxy_port}" for proxy_port in proxy_ports]
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.process.terminate()
+        self.process.join()
+
+
+def point_endpoints_at(base_url):
+    """Rewrite every DouyinAPIEndpoints url to the stand-in server and drop configured proxies"""
+    from douyin_scraper.douyin.web.endpoints import DouyinAPIEndpoints
+    from douyin_scraper.douyin.web.web_crawler import DouyinWebCrawler
+
+    for name, value in list(vars(DouyinAPIEndpoints).items()):
+        if isinstance(value, str) and value.startswith(DOUYIN_DOMAIN):
+            setattr(DouyinAPIEndpoints, name, base_url + value[len(DOUYIN_DOMAIN):])
+
+    get_douyin_headers = DouyinWebCrawler.get_douyin_headers
+
+    async def local_headers(self):
+        kwargs = await get_douyin_headers(self)
+        return dict(kwargs, proxies={'http://': None, 'https://': None})
+
+    DouyinWebCrawler.get_douyin_headers = local_headers
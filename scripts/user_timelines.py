@@ -0,0 +1,146 @@
+import asyncio
+import json
+import os
+import time
+
+import polars as pl
+
+from part_store import PartStore
+from probe_index import load_probe_index
+
+USER_POSTS_PATH = './data/douyin_videos'
+# scrape_users.py wrote the single-file dataset to the working directory, scrape_related_posts.py
+# read it from ./data, whichever exists is imported
+LEGACY_USER_POSTS_PATHS = ('douyin_videos.parquet.zstd', './data/douyin_videos.parquet.zstd')
+
+# fields that are always empty structs, which polars cannot infer
+SCHEMA_OVERRIDES = {
+    'show_follow_button': pl.Struct({'dummy': pl.Null}),
+    'video_game_data_channel_config': pl.Struct({'dummy': pl.Null}),
+    'image_comment': pl.Struct({'dummy': pl.Null}),
+    'series_basic_info': pl.Struct({'dummy': pl.Null}),
+}
+
+
+class UserTimelineCrawler:
+    """Pages many user timelines concurrently, writing every page as it arrives.
+
+    Pages of one user are fetched in order by following max_cursor, users are spread over
+    `concurrency` workers. The cursor of every user is checkpointed after each page, so a full
+    crawl resumes where it stopped and finished users are skipped. In refresh mode each user is
+    paged from the newest post until a page reaches a post that is already stored. With a
+    VideoCorpus, new posts are added to it as they are stored, so the corpus never has to be
+    merged with the whole timeline store.
+    """
+    def __init__(self, crawler, path=USER_POSTS_PATH, legacy_paths=LEGACY_USER_POSTS_PATHS, concurrency=8, page_size=20,
+                 corpus=None):
+        self.crawler = crawler
+        self.corpus = corpus
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.store = PartStore(path, auto_compact=True)
+        for legacy_path in legacy_paths:
+            self.store.import_file(legacy_path)
+        self.index = load_probe_index(path + '_index', self.store)
+        self.state_path = path + '_users.json'
+        self.users = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as f:
+                self.users = json.load(f)
+
+    def save(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.users, f)
+        os.replace(tmp_path, self.state_path)
+
+    def flush_page(self, aweme_list):
+        """Store the posts of a page not stored yet, returns (new, already stored) counts"""
+        new_items = []
+        new_ids = set()
+        num_stored = 0
+        for item in aweme_list:
+            aweme_id = item.get('aweme_id')
+            if not aweme_id or aweme_id in new_ids:
+                continue
+            if aweme_id in self.index:
+                # pinned posts come first regardless of age, they say nothing about where we are
+                if not item.get('is_top'):
+                    num_stored += 1
+                continue
+            new_ids.add(aweme_id)
+            new_items.append(item)
+
+        if new_items:
+            self.store.append(pl.from_dicts(new_items, infer_schema_length=len(new_items), schema_overrides=SCHEMA_OVERRIDES, strict=False))
+            self.index.add(list(new_ids))
+            if self.corpus is not None:
+                self.corpus.upsert(new_items, source='user_posts')
+        return len(new_items), num_stored
+
+    async def crawl_user(self, sec_uid, refresh=False, pbar=None):
+        user = self.users.setdefault(sec_uid, {'max_cursor': 0, 'done': False, 'posts': 0})
+        if not refresh and user['done']:
+            return 0
+        # an interrupted refresh continues below the posts it already stored
+        cursor = user.get('refresh_cursor', 0) if refresh else user['max_cursor']
+        cursor_key = 'refresh_cursor' if refresh else 'max_cursor'
+
+        num_new = 0
+        while True:
+            results = await self.crawler.fetch_user_post_videos(sec_uid, cursor, self.page_size)
+            if 'aweme_list' not in results:
+                # kept at the current cursor, tried again on the next run
+                print(f"No posts returned for user {sec_uid} at cursor {cursor}")
+                self.save()
+                return num_new
+            page_new, page_stored = self.flush_page(results['aweme_list'] or [])
+            num_new += page_new
+            user['posts'] += page_new
+            if pbar is not None:
+                pbar.update(1)
+                pbar.set_postfix(user=sec_uid[-8:], new_posts=user['posts'], refresh=False)
+
+            has_more = bool(results.get('has_more', False))
+            next_cursor = results.get('max_cursor', 0)
+            if not has_more or not next_cursor or next_cursor == cursor:
+                user['done'] = True
+                break
+            if refresh and page_stored > 0:
+                break
+            cursor = next_cursor
+            user[cursor_key] = cursor
+            self.save()
+
+        if refresh:
+            user.pop('refresh_cursor', None)
+            user['refreshed_at'] = time.time()
+        self.save()
+        return num_new
+
+    async def worker(self, queue, refresh, pbar):
+        num_new = 0
+        while True:
+            try:
+                sec_uid = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return num_new
+            try:
+                num_new += await self.crawl_user(sec_uid, refresh=refresh, pbar=pbar)
+            except Exception as e:
+                # the checkpoint keeps the last cursor, the next run continues from there
+                print(f"Error fetching posts for user {sec_uid}: {e}")
+                self.save()
+
+    async def run(self, sec_uids, refresh=False, pbar=None):
+        """Crawl or refresh every user, returns the number of new posts stored"""
+        queue = asyncio.Queue()
+        for sec_uid in sec_uids:
+            queue.put_nowait(sec_uid)
+        try:
+            counts = await asyncio.gather(*[self.worker(queue, refresh, pbar) for _ in range(self.concurrency)])
+        finally:
+            self.save()
+            self.index.checkpoint()
+            self.store.wait_for_compaction()
+        return sum(counts)
@@ -0,0 +1,94 @@
+import asyncio
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class BatchWriter:
+    """Writes batches on a dedicated thread so the event loop never waits on serialization or fsync.
+
+    Items are put into a bounded queue, a full queue makes put() wait, which is what slows the
+    fetch workers down when the disk cannot keep up. A batch is written by `write(batch)` once it
+    holds `batch_size` items or its oldest item is `max_latency` seconds old, whichever comes
+    first. `on_written(batch)` then runs on the event loop, so bookkeeping that is shared with the
+    fetch side (probe index, frontier) stays single threaded and only ever sees written batches.
+    `on_failed(batch)` runs there instead for a batch whose write raised. close() writes what is
+    left and waits for it.
+    """
+    def __init__(self, write, on_written=None, batch_size=256, max_latency=5.0, max_pending=None, on_failed=None):
+        self.write = write
+        self.on_written = on_written
+        self.on_failed = on_failed
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.queue = queue.Queue(maxsize=max_pending or batch_size * 4)
+        self.loop = None
+        self.thread = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.thread = threading.Thread(target=self._run, name='batch-writer', daemon=True)
+        self.thread.start()
+        return self
+
+    async def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            await asyncio.to_thread(self.queue.put, item)
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    async def close(self):
+        """Write everything queued so far and stop the thread"""
+        if self.thread is None:
+            return
+        await asyncio.to_thread(self.queue.put, _STOP)
+        await asyncio.to_thread(self.thread.join)
+        self.thread = None
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if not batch else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._flush(batch)
+                return
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.max_latency
+                batch.append(item)
+            if len(batch) >= self.batch_size or (batch and time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+
+    async def _call(self, callback, batch):
+        callback(batch)
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        try:
+            self.write(batch)
+        except Exception as e:
+            # not passed on, so the batch stays unresolved and is probed again on the next run
+            print(f"Error writing batch of {len(batch)}: {e}")
+            if self.on_failed is not None:
+                try:
+                    asyncio.run_coroutine_threadsafe(self._call(self.on_failed, batch), self.loop).result()
+                except Exception as e:
+                    print(f"Error recording failed batch of {len(batch)}: {e}")
+            return
+        if self.on_written is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self._call(self.on_written, batch), self.loop).result()
+            except Exception as e:
+                print(f"Error recording written batch of {len(batch)}: {e}")